@@ -0,0 +1,190 @@
+"""Benchmarks for reading redax output with the DAQReader
+
+Run with asv (``asv run``) or as a script for a quick overview:
+    python -m benchmarks.daqreader
+"""
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import strax
+import straxen
+
+N_FILES = 60
+RECORDS_PER_FILE = 5000
+RECORD_LENGTH = 110
+CHUNK_DURATION = int(5e9)
+
+
+def write_chunk_folder(path, compressor,
+                       n_files=N_FILES,
+                       records_per_file=RECORDS_PER_FILE):
+    """Write one redax chunk folder of n_files time-sorted readout
+    thread files, one channel per file. Returns the number of
+    uncompressed bytes written.
+    """
+    records = straxen.fake_daq_records(
+        0, CHUNK_DURATION, np.arange(n_files),
+        rate=records_per_file / (CHUNK_DURATION / 1e9),
+        pulse_length=RECORD_LENGTH,
+        record_length=RECORD_LENGTH,
+        rng=42)
+    straxen.write_redax_folder(path, records,
+                               reader_channels=[[ch] for ch in range(n_files)],
+                               compressor=compressor)
+    return records.nbytes
+
+
+def get_daq_reader(daq_input_dir, compressor, **config):
+    st = strax.Context(
+        register=straxen.DAQReader,
+        config=dict(daq_input_dir=daq_input_dir,
+                    daq_compressor=compressor,
+                    daq_chunk_duration=CHUNK_DURATION,
+                    readout_threads={'reader': N_FILES},
+                    channel_map=straxen.contexts.xnt_common_config['channel_map'],
+                    record_length=RECORD_LENGTH,
+                    **config))
+    return st.get_single_plugin('0', 'raw_records')
+
+
+class DecompressionThreads:
+    """Loading one central chunk folder for several thread counts"""
+    params = ([1, 2, 4, 8], ['lz4', 'zstd', 'blosc'])
+    param_names = ['threads', 'compressor']
+    timeout = 300
+
+    def setup_cache(self):
+        base = os.path.abspath('daq_data')
+        n_bytes = dict()
+        for compressor in self.params[1]:
+            n_bytes[compressor] = write_chunk_folder(
+                os.path.join(base, compressor, '000000'), compressor)
+        return base, n_bytes
+
+    def setup(self, cache, threads, compressor):
+        base, _ = cache
+        self.path = os.path.join(base, compressor, '000000')
+        self.plugin = get_daq_reader(
+            os.path.join(base, compressor),
+            compressor,
+            daq_decompression_threads=threads)
+
+    def _load(self):
+        self.plugin._load_chunk(self.path, 0, CHUNK_DURATION)
+
+    def time_load_chunk(self, cache, threads, compressor):
+        self._load()
+
+    def track_mb_per_s(self, cache, threads, compressor):
+        _, n_bytes = cache
+        t0 = time.perf_counter()
+        self._load()
+        return n_bytes[compressor] / 1e6 / (time.perf_counter() - t0)
+
+    track_mb_per_s.unit = 'MB/s'
+
+
+class MergeReadoutThreads:
+    """Merging the sorted files of the readout threads and splitting
+    by channel range, versus concatenating and sorting all records
+    """
+    timeout = 300
+
+    def setup(self):
+        self.base = base = tempfile.mkdtemp()
+        path = os.path.join(base, '000000')
+        write_chunk_folder(path, 'lz4')
+        self.plugin = get_daq_reader(base, 'lz4')
+        self.records_list = self.plugin._load_files(path)
+        self.channel_ranges = self.plugin.channel_ranges
+        # Compile
+        straxen.merge_sorted_records(self.records_list[:2], self.channel_ranges)
+        straxen.split_channel_ranges(self.records_list[0], self.channel_ranges)
+
+    def teardown(self):
+        shutil.rmtree(self.base)
+
+    def time_merge_sorted_records(self):
+        records, which_detector = straxen.merge_sorted_records(
+            self.records_list, self.channel_ranges)
+        straxen.plugins.daqreader._split_by_detector(
+            records, which_detector, len(self.channel_ranges))
+
+    def time_concatenate_and_sort(self):
+        records = strax.sort_by_time(np.concatenate(self.records_list))
+        straxen.split_channel_ranges(records, self.channel_ranges)
+
+
+class UncompressedIngest:
+    """Memory-mapped uncompressed files versus the default lz4 files"""
+    params = ['none', 'lz4']
+    param_names = ['compressor']
+    timeout = 300
+
+    def setup_cache(self):
+        base = os.path.abspath('daq_data_uncompressed')
+        for compressor in self.params:
+            write_chunk_folder(
+                os.path.join(base, compressor, '000000'), compressor)
+        return base
+
+    def setup(self, base, compressor):
+        self.path = os.path.join(base, compressor, '000000')
+        self.plugin = get_daq_reader(os.path.join(base, compressor), compressor)
+
+    def _load(self):
+        self.plugin._load_chunk(self.path, 0, CHUNK_DURATION)
+
+    def time_load_chunk(self, base, compressor):
+        self._load()
+
+    def peakmem_load_chunk(self, base, compressor):
+        self._load()
+
+    def track_peak_allocated_mb(self, base, compressor):
+        """Peak memory allocated by numpy while loading, memory-mapped
+        pages of the page cache are not included.
+        """
+        tracemalloc.start()
+        self._load()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak / 1e6
+
+    track_peak_allocated_mb.unit = 'MB'
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        bench = DecompressionThreads()
+        cache = bench.setup_cache()
+        for compressor in bench.params[1]:
+            for threads in bench.params[0]:
+                bench.setup(cache, threads, compressor)
+                bench._load()  # warm up (numba, page cache)
+                mbs = bench.track_mb_per_s(cache, threads, compressor)
+                print(f'{compressor:6s} {threads:2d} threads: {mbs:7.1f} MB/s')
+
+        bench = UncompressedIngest()
+        base = bench.setup_cache()
+        for compressor in bench.params:
+            bench.setup(base, compressor)
+            bench._load()
+            t0 = time.perf_counter()
+            bench._load()
+            dt = time.perf_counter() - t0
+            peak = bench.track_peak_allocated_mb(base, compressor)
+            print(f'{compressor:6s} load: {dt:.3f} s, peak allocated {peak:.0f} MB')
+        os.chdir('..')
+
+    bench = MergeReadoutThreads()
+    bench.setup()
+    for name in ('time_merge_sorted_records', 'time_concatenate_and_sort'):
+        t0 = time.perf_counter()
+        getattr(bench, name)()
+        print(f'{name}: {time.perf_counter() - t0:.3f} s')
@@ -0,0 +1,169 @@
+"""Benchmarks for ingesting synthetic redax output at several rates
+
+Run with asv (``asv run``) or as a script for a quick overview:
+    python -m benchmarks.ingest
+"""
+import os
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import strax
+import straxen
+
+RATE_MULTIPLIERS = [1, 5, 20]
+N_CHUNKS = 3
+CHUNK_DURATION = int(1e8)
+OVERLAP_DURATION = int(1e7)
+N_READERS = 8
+N_TPC_PMTS = 494
+
+
+def write_run(daq_input_dir, rate_multiplier):
+    """Write a synthetic TPC run at rate_multiplier times the nominal
+    rate, returns the statistics of write_fake_daq_run
+    """
+    return straxen.write_fake_daq_run(
+        daq_input_dir,
+        n_chunks=N_CHUNKS,
+        chunk_duration=CHUNK_DURATION,
+        overlap_duration=OVERLAP_DURATION,
+        n_channels=N_TPC_PMTS,
+        n_readers=N_READERS,
+        rate=rate_multiplier * straxen.NOMINAL_TPC_RATE)
+
+
+def get_context(daq_input_dir):
+    """Context without storage, so everything is computed every time"""
+    return strax.Context(
+        storage=[],
+        register=[straxen.DAQReader, straxen.PulseProcessing],
+        config=dict(daq_input_dir=daq_input_dir,
+                    daq_chunk_duration=CHUNK_DURATION,
+                    daq_overlap_chunk_duration=OVERLAP_DURATION,
+                    readout_threads={'reader': N_READERS},
+                    channel_map=straxen.contexts.xnt_common_config['channel_map'],
+                    n_tpc_pmts=N_TPC_PMTS))
+
+
+class DAQIngest:
+    """raw_records and records from synthetic redax output at multiples
+    of the nominal TPC rate
+    """
+    params = RATE_MULTIPLIERS
+    param_names = ['rate_multiplier']
+    timeout = 600
+    # Nothing is cached, but keep the measurements per single run
+    number = 1
+
+    def setup_cache(self):
+        base = os.path.abspath('daq_ingest')
+        raw_bytes = dict()
+        for rate_multiplier in self.params:
+            raw_bytes[rate_multiplier] = write_run(
+                os.path.join(base, f'{rate_multiplier}x'),
+                rate_multiplier)['raw_bytes']
+        return base, raw_bytes
+
+    def setup(self, cache, rate_multiplier):
+        base, _ = cache
+        self.st = get_context(os.path.join(base, f'{rate_multiplier}x'))
+        # At high rates there are no safe breaks in the overlap chunks
+        warnings.simplefilter('ignore',
+                              straxen.plugins.daqreader.ArtificialDeadtimeInserted)
+
+    def _mb_per_s(self, cache, rate_multiplier, target):
+        _, raw_bytes = cache
+        t0 = time.perf_counter()
+        self.st.make('0', target)
+        return raw_bytes[rate_multiplier] / 1e6 / (time.perf_counter() - t0)
+
+    def time_raw_records(self, cache, rate_multiplier):
+        self.st.make('0', 'raw_records')
+
+    def time_records(self, cache, rate_multiplier):
+        self.st.make('0', 'records')
+
+    def track_raw_records_mb_per_s(self, cache, rate_multiplier):
+        return self._mb_per_s(cache, rate_multiplier, 'raw_records')
+
+    track_raw_records_mb_per_s.unit = 'MB/s'
+
+    def track_records_mb_per_s(self, cache, rate_multiplier):
+        return self._mb_per_s(cache, rate_multiplier, 'records')
+
+    track_records_mb_per_s.unit = 'MB/s'
+
+    def peakmem_records(self, cache, rate_multiplier):
+        self.st.make('0', 'records')
+
+
+class JointPulseProcessing:
+    """records and records_he from PulseProcessing and
+    PulseProcessingHighEnergy, versus from PulseProcessingJoint, at the
+    nominal TPC and high energy rates
+    """
+    params = ['separate', 'joint']
+    param_names = ['mode']
+    timeout = 600
+    number = 1
+
+    def setup_cache(self):
+        base = os.path.abspath('daq_ingest_he')
+        tpc = np.arange(N_TPC_PMTS)
+        he = np.arange(*straxen.contexts.xnt_common_config['channel_map']['he'])
+        straxen.write_fake_daq_run(
+            base,
+            n_chunks=N_CHUNKS,
+            chunk_duration=CHUNK_DURATION,
+            overlap_duration=OVERLAP_DURATION,
+            channels=np.concatenate([tpc, he]),
+            n_readers=N_READERS,
+            rate=np.concatenate([
+                np.full(len(tpc), straxen.NOMINAL_TPC_RATE),
+                np.full(len(he), straxen.NOMINAL_HE_RATE)]))
+        return base
+
+    def setup(self, base, mode):
+        self.st = get_context(base)
+        if mode == 'joint':
+            self.st.register(straxen.PulseProcessingJoint)
+        else:
+            self.st.register(straxen.PulseProcessingHighEnergy)
+        # Both records and records_he are targets
+        self.st.set_context_config(dict(allow_lazy=False))
+        warnings.simplefilter('ignore',
+                              straxen.plugins.daqreader.ArtificialDeadtimeInserted)
+
+    def time_records_and_records_he(self, base, mode):
+        self.st.make('0', ('records', 'records_he'))
+
+    def peakmem_records_and_records_he(self, base, mode):
+        self.st.make('0', ('records', 'records_he'))
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        bench = DAQIngest()
+        cache = bench.setup_cache()
+        for rate_multiplier in bench.params:
+            bench.setup(cache, rate_multiplier)
+            bench.time_records(cache, rate_multiplier)  # warm up (numba)
+            rr = bench.track_raw_records_mb_per_s(cache, rate_multiplier)
+            r = bench.track_records_mb_per_s(cache, rate_multiplier)
+            print(f'{rate_multiplier:2d}x nominal rate '
+                  f'({cache[1][rate_multiplier] / 1e6:.0f} MB): '
+                  f'raw_records {rr:6.1f} MB/s, records {r:6.1f} MB/s')
+
+        bench = JointPulseProcessing()
+        base = bench.setup_cache()
+        for mode in bench.params:
+            bench.setup(base, mode)
+            bench.time_records_and_records_he(base, mode)  # warm up
+            t0 = time.perf_counter()
+            bench.time_records_and_records_he(base, mode)
+            print(f'records and records_he, {mode}: '
+                  f'{time.perf_counter() - t0:.3f} s')
+        os.chdir('..')
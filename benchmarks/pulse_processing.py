@@ -0,0 +1,215 @@
+"""Benchmarks for the pulse processing of TPC raw_records
+
+Run with asv (``asv run``) or as a script for a quick overview:
+    python -m benchmarks.pulse_processing
+"""
+import time
+import tracemalloc
+
+import numpy as np
+import strax
+import straxen
+
+N_TPC_PMTS = 494
+DURATION = int(2e8)
+
+
+def fake_raw_records(rate_multiplier=20):
+    return straxen.fake_daq_records(
+        0, DURATION, np.arange(N_TPC_PMTS),
+        rate=rate_multiplier * straxen.NOMINAL_TPC_RATE,
+        rng=0)
+
+
+def muon_rich_records(n_muons=100):
+    """Records at the nominal rate with muon-like clusters of long
+    pulses in all channels on top
+    """
+    rng = np.random.default_rng(1)
+    background = straxen.prepare_records(fake_raw_records(1))
+    muons = []
+    for t in rng.integers(0, DURATION - int(1e6), size=n_muons):
+        n_records = rng.integers(1, 50, size=N_TPC_PMTS)
+        r = np.zeros(n_records.sum(), dtype=background.dtype)
+        r['channel'] = np.repeat(np.arange(N_TPC_PMTS), n_records)
+        r['record_i'] = np.concatenate([np.arange(n) for n in n_records])
+        r['dt'] = 10
+        r['length'] = 110
+        r['pulse_length'] = 110 * np.repeat(n_records, n_records)
+        r['time'] = t + r['record_i'] * 1100
+        r['area'] = rng.integers(0, 50_000, size=len(r))
+        muons.append(r)
+    return strax.sort_by_time(np.concatenate([background] + muons))
+
+
+class PrepareRecords:
+    """Converting raw_records to baselined and integrated records"""
+    timeout = 300
+
+    def setup(self):
+        self.raw_records = fake_raw_records()
+        # Compile
+        straxen.prepare_records(self.raw_records[:10])
+
+    def time_prepare_records(self):
+        straxen.prepare_records(self.raw_records)
+
+    def time_strax_chain(self):
+        r = strax.raw_to_records(self.raw_records)
+        strax.zero_out_of_bounds(r)
+        strax.baseline(r)
+        strax.integrate(r)
+
+    def peakmem_prepare_records(self):
+        straxen.prepare_records(self.raw_records)
+
+
+class PulseCounting:
+    """Pulse counting and the overlap check on ranges of records in
+    parallel, versus on all records in one thread
+    """
+    params = [1, 2, 4, 8]
+    param_names = ['n_shards']
+    timeout = 300
+
+    def setup(self, n_shards):
+        self.raw_records = fake_raw_records()
+        self.records = straxen.prepare_records(self.raw_records)
+        # Compile
+        self.time_count_pulses(n_shards)
+        self.time_check_overlaps(n_shards)
+
+    def time_count_pulses(self, n_shards):
+        straxen.plugins.pulse_processing.count_pulses(
+            self.records, N_TPC_PMTS, n_shards=n_shards)
+
+    def time_check_overlaps(self, n_shards):
+        straxen.check_overlaps(self.raw_records, n_shards=n_shards)
+
+    def time_check_overlaps_3000_channels(self, n_shards):
+        straxen.check_overlaps(self.raw_records, n_channels=3000,
+                               n_shards=n_shards)
+
+
+class HEVetoCandidates:
+    """Finding the regions to veto after large peaks, versus finding
+    them with strax.find_peaks as the software HE veto used to
+    """
+    timeout = 1200
+
+    def setup(self):
+        self.records = muon_rich_records()
+        self.to_pe = np.full(N_TPC_PMTS, 0.01)
+        # Number of samples of the veto region sum waveform, with the
+        # default PulseProcessing options
+        self.veto_n = 3001
+        # Compile
+        self.time_find_peaks()
+        self.time_he_veto_candidates()
+
+    def time_find_peaks(self):
+        strax.find_peaks(
+            self.records, self.to_pe,
+            gap_threshold=1,
+            left_extension=0,
+            right_extension=0,
+            min_channels=100,
+            min_area=int(1e5),
+            result_dtype=strax.peak_dtype(n_channels=N_TPC_PMTS,
+                                          n_sum_wv_samples=self.veto_n))
+
+    def time_he_veto_candidates(self):
+        straxen.he_veto_candidates(self.records, self.to_pe, DURATION)
+
+    def track_find_peaks_peak_allocated_mb(self):
+        tracemalloc.start()
+        self.time_find_peaks()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak / 1e6
+
+    track_find_peaks_peak_allocated_mb.unit = 'MB'
+
+    def track_he_veto_candidates_peak_allocated_mb(self):
+        tracemalloc.start()
+        self.time_he_veto_candidates()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak / 1e6
+
+    track_he_veto_candidates_peak_allocated_mb.unit = 'MB'
+
+
+class PeakletsFromStoredHits:
+    """records to peaklets, finding the hits again in Peaklets versus
+    using the hits stored by PulseProcessing
+    """
+    params = ['Peaklets', 'PeakletsFromHits']
+    param_names = ['plugin']
+    timeout = 600
+
+    def setup(self, plugin):
+        st = strax.Context(
+            storage=[],
+            register=[straxen.DAQReader,
+                      straxen.PulseProcessing,
+                      getattr(straxen, plugin)],
+            config=dict(channel_map=straxen.contexts.xnt_common_config['channel_map'],
+                        gain_model=('to_pe_constant', 0.005),
+                        n_tpc_pmts=N_TPC_PMTS))
+        raw_records = fake_raw_records()
+        pulse_processing = st.get_single_plugin('0', 'records')
+        result = pulse_processing.compute(raw_records, 0, DURATION)
+        self.records, self.hits = result['records'], result['hits']
+        self.plugin = st.get_single_plugin('0', 'peaklets')
+        # Compile
+        self.compute()
+
+    def compute(self):
+        if 'hits' in self.plugin.depends_on:
+            self.plugin.compute(self.records, self.hits, 0, DURATION)
+        else:
+            self.plugin.compute(self.records, 0, DURATION)
+
+    def time_peaklets(self, plugin):
+        self.compute()
+
+
+if __name__ == '__main__':
+    bench = HEVetoCandidates()
+    bench.setup()
+    print(f'{len(bench.records)} records')
+    for name in ('find_peaks', 'he_veto_candidates'):
+        t0 = time.perf_counter()
+        getattr(bench, 'time_' + name)()
+        dt = time.perf_counter() - t0
+        mb = getattr(bench, f'track_{name}_peak_allocated_mb')()
+        print(f'{name}: {dt:.3f} s, peak allocated {mb:.0f} MB')
+
+    bench = PeakletsFromStoredHits()
+    for plugin in bench.params:
+        bench.setup(plugin)
+        t0 = time.perf_counter()
+        bench.time_peaklets(plugin)
+        print(f'records to peaklets with {plugin}: '
+              f'{time.perf_counter() - t0:.3f} s')
+
+    bench = PulseCounting()
+    for n_shards in bench.params:
+        bench.setup(n_shards)
+        for name in ('time_count_pulses', 'time_check_overlaps',
+                     'time_check_overlaps_3000_channels'):
+            t0 = time.perf_counter()
+            getattr(bench, name)(n_shards)
+            print(f'{name} with {n_shards} shards: '
+                  f'{time.perf_counter() - t0:.3f} s')
+
+    bench = PrepareRecords()
+    bench.setup()
+    bench.time_strax_chain()
+    print(f'{len(bench.raw_records)} raw_records, '
+          f'{bench.raw_records.nbytes / 1e6:.0f} MB')
+    for name in ('time_prepare_records', 'time_strax_chain'):
+        t0 = time.perf_counter()
+        getattr(bench, name)()
+        print(f'{name}: {time.perf_counter() - t0:.3f} s')
@@ -46,7 +46,7 @@ setuptools.setup(name='straxen',
                  scripts=['bin/bootstrax', 'bin/straxer', 'bin/fake_daq',
                           'bin/microstrax', 'bin/ajax',
                           'bin/refresh_raw_records'],
-                 packages=setuptools.find_packages(),
+                 packages=setuptools.find_packages(exclude=['benchmarks']),
                  classifiers=[
                      'Development Status :: 4 - Beta',
                      'License :: OSI Approved :: BSD License',
@@ -16,6 +16,7 @@ from .mongo_storage import *
 from .online_monitor import *
 from .rundb import *
 from .scada import *
+from .synthetic_daq import *
 from .bokeh_utils import *
 
 # Nested structures:
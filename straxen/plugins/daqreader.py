@@ -1,14 +1,30 @@
 import glob
+import io
+import itertools
 import os
+import queue
 import shutil
+import threading
+import time
 import warnings
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from immutabledict import immutabledict
 import numpy as np
 import numba
 
 import strax
 
+try:
+    import inotify_simple
+    _INOTIFY_FLAGS = (inotify_simple.flags.CREATE
+                      | inotify_simple.flags.MOVED_TO
+                      | inotify_simple.flags.DELETE
+                      | inotify_simple.flags.MOVED_FROM)
+except ImportError:
+    # Optional, to watch the DAQ input directory with inotify
+    inotify_simple = None
+
 export, __all__ = strax.exporter()
 __all__ += ['ARTIFICIAL_DEADTIME_CHANNEL']
 
@@ -22,6 +38,49 @@ class ArtificialDeadtimeInserted(UserWarning):
     pass
 
 
+# Stages of reading a chunk that are timed in daqreader_stats
+DAQREADER_STAGES = ('listing', 'reading', 'decompressing', 'merging',
+                    'splitting', 'break_finding', 'deadtime')
+
+
+def _new_stats():
+    """Counters for the time per stage of reading one chunk"""
+    stats = {stage: 0. for stage in DAQREADER_STAGES}
+    stats.update(bytes_in=0, total=0.)
+    return stats
+
+
+@export
+def daqreader_stats_dtype():
+    return [
+        (('Start time of the chunk', 'time'), np.int64),
+        (('End time of the chunk', 'endtime'), np.int64),
+        (('Chunk number', 'chunk_i'), np.int32),
+        (('Bytes read from the files of the readout threads', 'bytes_in'),
+         np.int64),
+        (('Number of raw_records of all subdetectors', 'records_out'),
+         np.int64),
+        (('Time listing the chunk folders [s]', 't_listing'), np.float32),
+        (('Time reading files, summed over threads [s]', 't_reading'),
+         np.float32),
+        (('Time decompressing files, summed over threads [s]',
+          't_decompressing'), np.float32),
+        (('Time merging and sorting the files [s]', 't_merging'), np.float32),
+        (('Time splitting records by channel range [s]', 't_splitting'),
+         np.float32),
+        (('Time finding breaks in the overlap chunks [s]', 't_break_finding'),
+         np.float32),
+        (('Time inserting artificial deadtime [s]', 't_deadtime'),
+         np.float32),
+        (('Time compute waited for the chunk to be read [s]', 't_io_wait'),
+         np.float32),
+        (('Total time to read and split the chunk [s]', 't_total'),
+         np.float32),
+        (('Throughput in MB of raw_records per second of t_total',
+          'mb_per_s'), np.float32),
+    ]
+
+
 @export
 @strax.takes_config(
 
@@ -42,12 +101,18 @@ class ArtificialDeadtimeInserted(UserWarning):
                  default=int(5e8), type=int,
                  help="Duration of intermediate/overlap chunks in ns"),
     strax.Option('daq_compressor', default="lz4", track=False,
-                 help="Algorithm used for (de)compressing the live data"),
+                 help="Algorithm used for (de)compressing the live data. "
+                      "Uncompressed data ('none') is memory-mapped rather "
+                      "than read into memory."),
     strax.Option('readout_threads', type=dict, track=False,
                  help="Dictionary of the readout threads where the keys "
                       "specify the reader and value the number of threads"),
     strax.Option('daq_input_dir', type=str, track=False,
                  help="Directory where readers put data"),
+    strax.Option('daq_decompression_threads', default=4, track=False, type=int,
+                 help="Maximum number of threads used to load and decompress "
+                      "the files of the readout threads concurrently. Set to "
+                      "1 to load the files one after another."),
 
     # DAQReader settings
     strax.Option('safe_break_in_pulses', default=1000, track=False,
@@ -56,6 +121,17 @@ class ArtificialDeadtimeInserted(UserWarning):
                       "interior to peaklets."),
     strax.Option('erase', default=False, track=False,
                  help="Delete reader data after processing"),
+    strax.Option('daq_input_watcher', default='auto', track=False,
+                 help="How to keep track of the data arriving in "
+                      "daq_input_dir: 'inotify' (requires inotify_simple), "
+                      "'poll' (rescan the directory in the background), "
+                      "'auto' (inotify if available, else poll) or None "
+                      "(check the directory on every call)."),
+    strax.Option('daq_prefetch_depth', default=1, track=False, type=int,
+                 help="Number of chunks to read ahead in a background thread "
+                      "while the previous chunk is being processed. Set to 0 "
+                      "to read chunks only when they are computed. Only used "
+                      "when the DAQReader computes in the main process."),
     strax.Option('channel_map', track=False, type=immutabledict,
                  help="immutabledict mapping subdetector to (min, max) "
                       "channel number."))
@@ -75,6 +151,8 @@ class DAQReader(strax.Plugin):
         - raw_records_mv: muon veto raw_records.
         - raw_records_aqmon: raw_records for the acquisition monitor (_nv
         for neutron veto).
+        - daqreader_stats: time spent per stage of reading each chunk,
+        to find ingest bottlenecks.
     """
     provides = (
         'raw_records',
@@ -83,6 +161,7 @@ class DAQReader(strax.Plugin):
         'raw_records_nv',  # nveto raw_records (will not be stored long term)
         'raw_records_aqmon_nv',
         'raw_records_aux_mv',
+        'daqreader_stats',
         'raw_records_mv',    # mveto has to be last due to lineage
     )
 
@@ -96,6 +175,7 @@ class DAQReader(strax.Plugin):
         raw_records_nv=False,
         raw_records_aqmon_nv=True,
         raw_records_aux_mv=True,
+        daqreader_stats=True,
         raw_records_mv=False,
     )
     compressor = 'lz4'
@@ -103,14 +183,20 @@ class DAQReader(strax.Plugin):
 
     def infer_dtype(self):
         return {
-            d: strax.raw_record_dtype(
-                samples_per_record=self.config["record_length"])
+            d: (daqreader_stats_dtype() if d == 'daqreader_stats'
+                else strax.raw_record_dtype(
+                    samples_per_record=self.config["record_length"]))
             for d in self.provides}
 
     def setup(self):
         self.t0 = int(self.config['run_start_time']) * int(1e9)
         self.dt_max = self.config['max_digitizer_sampling_time']
         self.n_readout_threads = sum(self.config['readout_threads'].values())
+        self.channel_ranges = np.asarray(
+            list(self.config['channel_map'].values()))
+        self._watcher = None
+        self._prefetcher = None
+        self._allow_prefetch = True
         if (self.config['safe_break_in_pulses']
                 > min(self.config['daq_chunk_duration'],
                       self.config['daq_overlap_chunk_duration'])):
@@ -118,6 +204,45 @@ class DAQReader(strax.Plugin):
                 "Chunk durations must be larger than the minimum safe break"
                 " duration (preferably a lot larger!)")
 
+    def __getstate__(self):
+        # The watcher and prefetcher run threads and cannot be pickled.
+        # Copies of the plugin in worker processes just look at the
+        # filesystem and read their chunk themselves. Since different
+        # workers process different chunks, I/O still overlaps with
+        # computation.
+        state = self.__dict__.copy()
+        state['_watcher'] = None
+        state['_prefetcher'] = None
+        state['_allow_prefetch'] = False
+        return state
+
+    def cleanup(self, wait_for):
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+        super().cleanup(wait_for)
+
+    def _start_watcher(self):
+        """Start watching daq_input_dir, if not done already"""
+        if self._watcher is None and self.config['daq_input_watcher']:
+            self._watcher = DAQDirectoryWatcher(
+                self.config['daq_input_dir'],
+                complete_after=self.n_readout_threads,
+                method=self.config['daq_input_watcher'])
+
+    def _list_folder(self, path):
+        """Return the names of the files in path, or None if path does
+        not exist. Uses the watcher of daq_input_dir if there is one.
+        """
+        if self._watcher is not None:
+            return self._watcher.files(os.path.basename(path))
+        if not os.path.exists(path):
+            return None
+        return os.listdir(path)
+
     def _path(self, chunk_i):
         return self.config["daq_input_dir"] + f'/{chunk_i:06d}'
 
@@ -129,8 +254,9 @@ class DAQReader(strax.Plugin):
         p = self._path(chunk_i)
         result = []
         for q in [p + '_pre', p, p + '_post']:
-            if os.path.exists(q):
-                n_files = self._count_files_per_chunk(q)
+            files = self._list_folder(q)
+            if files is not None:
+                n_files = self._count_files_per_chunk(q, files)
                 if n_files >= self.n_readout_threads:
                     result.append(q)
                 else:
@@ -156,13 +282,13 @@ class DAQReader(strax.Plugin):
         """Convert name of part of the chunk to the thread_name that wrote it"""
         return '_'.join(partial_chunk.split('_')[:-1])
 
-    def _count_files_per_chunk(self, path_chunk_i):
+    def _count_files_per_chunk(self, path_chunk_i, files):
         """
         Check that the files in the chunks have names consistent with
         the readout threads
         """
         counted_files = Counter(
-            [self._partial_chunk_to_thread_name(p) for p in os.listdir(path_chunk_i)])
+            [self._partial_chunk_to_thread_name(p) for p in files])
         for thread, n_counts in counted_files.items():
             if thread not in self.config['readout_threads']:
                 raise ValueError(f'Bad data for {path_chunk_i}. Got {thread}')
@@ -172,16 +298,20 @@ class DAQReader(strax.Plugin):
         return sum(counted_files.values())
 
     def source_finished(self):
+        self._start_watcher()
         end_dir = self.config["daq_input_dir"] + '/THE_END'
-        if not os.path.exists(end_dir):
+        files = self._list_folder(end_dir)
+        if files is None:
             return False
         else:
-            return self._count_files_per_chunk(end_dir) >= self.n_readout_threads
+            return (self._count_files_per_chunk(end_dir, files)
+                    >= self.n_readout_threads)
 
     def is_ready(self, chunk_i):
+        self._start_watcher()
         ended = self.source_finished()
         pre, current, post = self._chunk_paths(chunk_i)
-        next_ahead = os.path.exists(self._path(chunk_i + 1))
+        next_ahead = self._list_folder(self._path(chunk_i + 1)) is not None
         if (current and (
                 (pre and post
                  or chunk_i == 0 and post
@@ -189,15 +319,83 @@ class DAQReader(strax.Plugin):
             return True
         return False
 
-    def _load_chunk(self, path, start, end, kind='central'):
-        records = [
-            strax.load_file(
-                fn,
-                compressor=self.config["daq_compressor"],
-                dtype=self.dtype_for('raw_records'))
-            for fn in sorted(glob.glob(f'{path}/*'))]
-        records = np.concatenate(records)
-        records = strax.sort_by_time(records)
+    def _load_file(self, fn):
+        """Load records from file fn
+
+        :returns: (records, bytes read, time reading, time decompressing)
+        """
+        t0 = time.perf_counter()
+        if self.config['daq_compressor'] in (None, 'none'):
+            records = self._map_file(fn)
+            return records, records.nbytes, time.perf_counter() - t0, 0.
+        with open(fn, mode='rb') as f:
+            data = f.read()
+        t1 = time.perf_counter()
+        records = strax.load_file(
+            io.BytesIO(data),
+            compressor=self.config["daq_compressor"],
+            dtype=self.dtype_for('raw_records'))
+        return records, len(data), t1 - t0, time.perf_counter() - t1
+
+    def _map_file(self, fn):
+        """Return a read-only view of the records in an uncompressed
+        file, straight from the page cache. Only the merged records of
+        all files will be copied into memory.
+        """
+        dtype = self.dtype_for('raw_records')
+        if not os.path.getsize(fn):
+            # np.memmap cannot map empty files
+            return np.zeros(0, dtype=dtype)
+        try:
+            return np.asarray(np.memmap(fn, dtype=dtype, mode='r'))
+        except ValueError as e:
+            raise strax.DataCorrupted(
+                f"Fatal Error while mapping file {fn}: {e}") from e
+
+    def _load_files(self, path, stats=None):
+        """Load the files of all readout threads in path
+
+        The files are decompressed by a bounded pool of threads. lz4,
+        zstd and blosc release the GIL while decompressing, so the
+        threads really run in parallel.
+
+        :param stats: optional dict to add the time per stage and the
+            number of bytes read to, see DAQREADER_STAGES.
+        """
+        t0 = time.perf_counter()
+        files = sorted(glob.glob(f'{path}/*'))
+        t_listing = time.perf_counter() - t0
+
+        n_threads = min(self.config['daq_decompression_threads'], len(files))
+        if n_threads <= 1:
+            loaded = [self._load_file(fn) for fn in files]
+        else:
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                loaded = list(pool.map(self._load_file, files))
+
+        if stats is not None:
+            stats['listing'] += t_listing
+            stats['bytes_in'] += sum([x[1] for x in loaded])
+            stats['reading'] += sum([x[2] for x in loaded])
+            stats['decompressing'] += sum([x[3] for x in loaded])
+        return [x[0] for x in loaded]
+
+    def _load_chunk(self, path, start, end, kind='central', stats=None):
+        """Load the data in path and find a break for overlap chunks
+
+        :param stats: optional dict to add the time per stage to, see
+            DAQREADER_STAGES.
+        :returns: (records, which_detector, break_time), which_detector
+            holds the index of the channel range of each record.
+        """
+        if stats is None:
+            stats = _new_stats()
+        records_list = self._load_files(path, stats)
+        t0 = time.perf_counter()
+        records, which_detector = merge_sorted_records(
+            records_list, self.channel_ranges)
+        del records_list
+        stats['merging'] += time.perf_counter() - t0
 
         first_start, last_start, last_end = None, None, None
         if len(records):
@@ -217,14 +415,17 @@ class DAQReader(strax.Plugin):
 
         if kind == 'central':
             result = records
+            result_detector = which_detector
             break_time = None
         else:
             # Find a time at which we can safely partition the data.
+            t0 = time.perf_counter()
             min_gap = self.config['safe_break_in_pulses']
             if not len(records) or last_end + min_gap < end:
                 # There is enough room at the end of the data
                 break_time = end - min_gap
                 result = records if kind == 'post' else records[:0]
+                result_detector = which_detector[:len(result)]
             else:
                 # Let's hope there is some quiet time in the middle
                 try:
@@ -236,7 +437,13 @@ class DAQReader(strax.Plugin):
                                     + self.config['record_length'] * self.dt_max),
                         left=kind == 'post',
                         tolerant=False)
+                    if kind == 'post':
+                        result_detector = which_detector[:len(result)]
+                    else:
+                        result_detector = which_detector[len(records) - len(result):]
                 except strax.NoBreakFound:
+                    stats['break_finding'] += time.perf_counter() - t0
+                    t0 = time.perf_counter()
                     # We still have to break somewhere, but this can involve
                     # throwing away data.
                     # Let's do it at the end of the chunk
@@ -268,10 +475,16 @@ class DAQReader(strax.Plugin):
                                             self._artificial_dead_time(
                                                 start=dead_time_start,
                                                 end=break_time, dt=self.dt_max)]))
+                    # Rare enough to just assign the channel ranges again
+                    result_detector = _assign_channel_ranges(
+                        result, self.channel_ranges)
+                    stats['deadtime'] += time.perf_counter() - t0
+                else:
+                    stats['break_finding'] += time.perf_counter() - t0
 
         if self.config['erase']:
             shutil.rmtree(path)
-        return result, break_time
+        return result, result_detector, break_time
 
     def _artificial_dead_time(self, start, end, dt):
         return strax.dict_to_rec(
@@ -281,7 +494,14 @@ class DAQReader(strax.Plugin):
                  channel=[ARTIFICIAL_DEADTIME_CHANNEL]),
             self.dtype_for('raw_records'))
 
-    def compute(self, chunk_i):
+    def _read_chunk(self, chunk_i):
+        """Load the data of chunk_i and the overlap chunks around it
+
+        :returns: (records, which_detector, break_pre, break_post, stats),
+            stats is a dict with the time spent per stage.
+        """
+        t_read_start = time.perf_counter()
+        stats = _new_stats()
         dt_central = self.config['daq_chunk_duration']
         dt_overlap = self.config['daq_overlap_chunk_duration']
 
@@ -289,7 +509,9 @@ class DAQReader(strax.Plugin):
         t_end = t_start + dt_central
 
         pre, current, post = self._chunk_paths(chunk_i)
+        stats['listing'] += time.perf_counter() - t_read_start
         r_pre, r_post = None, None
+        d_pre, d_post = None, None
         break_pre, break_post = t_start, t_end
 
         if pre:
@@ -299,35 +521,68 @@ class DAQReader(strax.Plugin):
                     f"for chunk 0. We're ignoring it.",
                     UserWarning)
             else:
-                r_pre, break_pre = self._load_chunk(
+                r_pre, d_pre, break_pre = self._load_chunk(
                     path=pre,
                     start=t_start - dt_overlap,
                     end=t_start,
-                    kind='pre')
+                    kind='pre',
+                    stats=stats)
 
-        r_main, _ = self._load_chunk(
+        r_main, d_main, _ = self._load_chunk(
             path=current,
             start=t_start,
             end=t_end,
-            kind='central')
+            kind='central',
+            stats=stats)
 
         if post:
-            r_post, break_post = self._load_chunk(
+            r_post, d_post, break_post = self._load_chunk(
                 path=post,
                 start=t_end,
                 end=t_end + dt_overlap,
-                kind='post')
+                kind='post',
+            stats=stats)
 
         # Concatenate the result.
         records = np.concatenate([
             x for x in (r_pre, r_main, r_post)
             if x is not None])
+        which_detector = np.concatenate([
+            x for x in (d_pre, d_main, d_post)
+            if x is not None])
+        stats['total'] = time.perf_counter() - t_read_start
+        return records, which_detector, break_pre, break_post, stats
+
+    def _get_chunk(self, chunk_i):
+        """Return the loaded chunk_i, from the prefetcher if possible"""
+        if not (self.config['daq_prefetch_depth'] and self._allow_prefetch):
+            return self._read_chunk(chunk_i)
+        if self._prefetcher is None:
+            self._prefetcher = ChunkPrefetcher(
+                read=self._read_chunk,
+                is_ready=self.is_ready,
+                source_finished=self.source_finished,
+                first_chunk=chunk_i,
+                depth=self.config['daq_prefetch_depth'])
+        return self._prefetcher.get(chunk_i)
 
-        # Split records by channel
-        result_arrays = split_channel_ranges(
-            records,
-            np.asarray(list(self.config['channel_map'].values())))
-        del records
+    def compute(self, chunk_i):
+        t0 = time.perf_counter()
+        records, which_detector, break_pre, break_post, stats = \
+            self._get_chunk(chunk_i)
+        # Time we waited for the data to be read (all of the reading
+        # time if nothing was prefetched)
+        io_wait = time.perf_counter() - t0
+
+        # Split records by channel, the channel ranges were already
+        # assigned while merging the files of the readout threads.
+        t0 = time.perf_counter()
+        result_arrays = _split_by_detector(
+            records, which_detector, len(self.channel_ranges))
+        stats['splitting'] = time.perf_counter() - t0
+        stats['total'] += stats['splitting']
+        n_bytes_out = records.nbytes
+        del records, which_detector
 
         # Convert to strax chunks
         result = dict()
@@ -355,13 +610,45 @@ class DAQReader(strax.Plugin):
                 data=result_arrays[i],
                 data_type=result_name)
 
-        print(f"Read chunk {chunk_i:06d} from DAQ")
+        if 'daqreader_stats' in self.provides:
+            result['daqreader_stats'] = self.chunk(
+                start=self.t0 + break_pre,
+                end=self.t0 + break_post,
+                data=self._stats_array(
+                    stats,
+                    chunk_i=chunk_i,
+                    start=self.t0 + break_pre,
+                    end=self.t0 + break_post,
+                    records_out=sum([len(x) for x in result_arrays]),
+                    n_bytes_out=n_bytes_out,
+                    io_wait=io_wait),
+                data_type='daqreader_stats')
+
+        print(f"Read chunk {chunk_i:06d} from DAQ, "
+              f"waited {io_wait:.2f} s for I/O")
         for r in result.values():
             # Print data rate / data type if any
-            if r._mbs() > 0:
+            if r._mbs() > 0 and r.data_type != 'daqreader_stats':
                 print(f"\t{r}")
         return result
 
+    def _stats_array(self, stats, chunk_i, start, end,
+                     records_out, n_bytes_out, io_wait):
+        """Convert the stats of reading chunk_i to a daqreader_stats row"""
+        r = np.zeros(1, dtype=self.dtype_for('daqreader_stats'))
+        r['time'] = start
+        r['endtime'] = end
+        r['chunk_i'] = chunk_i
+        r['bytes_in'] = stats['bytes_in']
+        r['records_out'] = records_out
+        for stage in DAQREADER_STAGES:
+            r['t_' + stage] = stats[stage]
+        r['t_io_wait'] = io_wait
+        r['t_total'] = stats['total']
+        if stats['total'] > 0:
+            r['mb_per_s'] = n_bytes_out / 1e6 / stats['total']
+        return r
+
 
 @export
 class Fake1TDAQReader(DAQReader):
@@ -373,6 +660,254 @@ class Fake1TDAQReader(DAQReader):
     data_kind = immutabledict(zip(provides, provides))
 
 
+@export
+class ChunkPrefetcher:
+    """
+    Read chunks in a background thread, as soon as they are ready, into
+    a bounded queue. This way reading (I/O, decompressing and sorting)
+    of the next chunks overlaps with processing the current one.
+    """
+
+    def __init__(self, read, is_ready, source_finished,
+                 first_chunk=0, depth=1, poll_interval=1.):
+        """
+        :param read: function taking chunk_i, returning the loaded chunk
+        :param is_ready: function taking chunk_i, returning whether the
+            chunk can be read
+        :param source_finished: function returning whether no more
+            chunks will arrive
+        :param first_chunk: number of the first chunk to read
+        :param depth: maximum number of chunks to read ahead
+        :param poll_interval: time in seconds between checks whether
+            the next chunk is ready
+        """
+        self.read = read
+        self.is_ready = is_ready
+        self.source_finished = source_finished
+        self.poll_interval = poll_interval
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_ahead,
+                                        args=(first_chunk,),
+                                        name='ChunkPrefetcher',
+                                        daemon=True)
+        self._thread.start()
+
+    def get(self, chunk_i):
+        """Wait for chunk_i and return it. Chunks must be requested
+        in order.
+        """
+        while True:
+            try:
+                got_i, result, exception = self._queue.get(
+                    timeout=self.poll_interval)
+                break
+            except queue.Empty:
+                if not self._thread.is_alive() and self._queue.empty():
+                    raise RuntimeError(f"Prefetcher stopped before chunk "
+                                       f"{chunk_i} was ready")
+        if exception is not None:
+            raise exception
+        if got_i != chunk_i:
+            raise RuntimeError(f"Prefetched chunk {got_i} while chunk "
+                               f"{chunk_i} was requested")
+        return result
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _read_ahead(self, first_chunk):
+        for chunk_i in itertools.count(first_chunk):
+            while not self.is_ready(chunk_i):
+                if self.source_finished() and not self.is_ready(chunk_i):
+                    return
+                if self._stop.wait(self.poll_interval):
+                    return
+            try:
+                item = (chunk_i, self.read(chunk_i), None)
+            except Exception as e:
+                item = (chunk_i, None, e)
+
+            while True:
+                try:
+                    self._queue.put(item, timeout=self.poll_interval)
+                    break
+                except queue.Full:
+                    if self._stop.is_set():
+                        return
+            if item[2] is not None:
+                # Let the consumer raise the exception
+                return
+
+
+@export
+class DAQDirectoryWatcher:
+    """
+    Keep an in-memory map of the folders in the DAQ input directory
+    and the files in them, so the DAQReader does not have to hit the
+    (shared) filesystem every time it checks if a chunk is ready.
+
+    The map is kept up to date by a background thread that either
+    listens to inotify events (if inotify_simple is installed) or
+    rescans the directory every poll_interval seconds.
+    """
+
+    def __init__(self, path, complete_after, method='auto', poll_interval=1.):
+        """
+        :param path: directory to watch, e.g. daq_input_dir
+        :param complete_after: number of files after which a folder is
+            complete. Complete folders are not rescanned when polling.
+        :param method: 'inotify', 'poll' or 'auto' (inotify if available)
+        :param poll_interval: time in seconds between rescans when
+            polling, or between checks whether to stop when using inotify
+        """
+        if method == 'auto':
+            method = 'poll' if inotify_simple is None else 'inotify'
+        if method not in ('inotify', 'poll'):
+            raise ValueError(f'Unknown method {method} to watch {path}')
+        if method == 'inotify' and inotify_simple is None:
+            raise ImportError('Install inotify_simple to use inotify')
+
+        self.path = path
+        self.method = method
+        self.complete_after = complete_after
+        self.poll_interval = poll_interval
+        self._folders = dict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        target = self._inotify_loop if method == 'inotify' else self._poll_loop
+        self._thread = threading.Thread(target=target,
+                                        name=f'DAQDirectoryWatcher_{path}',
+                                        daemon=True)
+        # Do a first scan ourselves so the map is up to date right away
+        if method == 'poll':
+            self._rescan()
+        else:
+            self._inotify = inotify_simple.INotify()
+            self._watches = dict()
+            self._root_watch = None
+            self._watch_root()
+        self._thread.start()
+
+    def files(self, folder):
+        """Return the set of files in folder, or None if the folder
+        does not exist (yet)
+        """
+        with self._lock:
+            files = self._folders.get(folder)
+            return None if files is None else set(files)
+
+    def stop(self):
+        self._stop.set()
+        if self.method == 'poll':
+            self._thread.join()
+        # Waiting for a blocking inotify read to time out would delay
+        # the end of processing by up to poll_interval; the thread
+        # closes the inotify instance itself when it notices the stop.
+
+    def _listdir(self, folder):
+        try:
+            return set(os.listdir(os.path.join(self.path, folder)))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def _rescan(self):
+        """Scan the directory for new folders and files"""
+        try:
+            folders = [e.name for e in os.scandir(self.path) if e.is_dir()]
+        except FileNotFoundError:
+            folders = []
+        with self._lock:
+            known = dict(self._folders)
+        new = dict()
+        for folder in folders:
+            files = known.get(folder)
+            if files is None or len(files) < self.complete_after:
+                files = self._listdir(folder)
+                if files is None:
+                    # Removed in the meantime
+                    continue
+            new[folder] = files
+        with self._lock:
+            self._folders = new
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            self._rescan()
+
+    def _watch_root(self):
+        """Start watching the directory if it exists"""
+        if not os.path.exists(self.path):
+            return
+        self._root_watch = self._inotify.add_watch(self.path, _INOTIFY_FLAGS)
+        for folder in self._listdir(''):
+            self._add_folder(folder)
+
+    def _add_folder(self, folder):
+        try:
+            wd = self._inotify.add_watch(os.path.join(self.path, folder),
+                                         _INOTIFY_FLAGS)
+        except OSError:
+            # Removed in the meantime, or not a directory
+            return
+        # Only list the files after the watch exists, so we miss nothing
+        files = self._listdir(folder)
+        if files is None:
+            return
+        self._watches[wd] = folder
+        with self._lock:
+            self._folders[folder] = files
+
+    def _remove_folder(self, folder):
+        with self._lock:
+            self._folders.pop(folder, None)
+        for wd, name in list(self._watches.items()):
+            if name == folder:
+                del self._watches[wd]
+
+    def _inotify_loop(self):
+        flags = inotify_simple.flags
+        while not self._stop.is_set():
+            if self._root_watch is None:
+                self._stop.wait(self.poll_interval)
+                self._watch_root()
+                continue
+            for event in self._inotify.read(
+                    timeout=int(1000 * self.poll_interval)):
+                if event.mask & flags.Q_OVERFLOW:
+                    # We missed events, start over
+                    self._inotify.close()
+                    self._inotify = inotify_simple.INotify()
+                    self._watches = dict()
+                    self._root_watch = None
+                    with self._lock:
+                        self._folders = dict()
+                    self._watch_root()
+                    break
+                if event.wd == self._root_watch:
+                    if not event.mask & flags.ISDIR:
+                        continue
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        self._add_folder(event.name)
+                    elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                        self._remove_folder(event.name)
+                    continue
+                folder = self._watches.get(event.wd)
+                if folder is None:
+                    continue
+                with self._lock:
+                    files = self._folders.get(folder)
+                    if files is None:
+                        continue
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        files.add(event.name)
+                    elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                        files.discard(event.name)
+        self._inotify.close()
+
+
 @export
 @numba.njit(nogil=True, cache=True)
 def split_channel_ranges(records, channel_ranges):
@@ -380,32 +915,45 @@ def split_channel_ranges(records, channel_ranges):
 
     ~2.5x as fast as a naive implementation with np.in1d
     """
-    n_subdetectors = len(channel_ranges)
-    which_detector = np.zeros(len(records), dtype=np.int8)
-    n_in_detector = np.zeros(n_subdetectors, dtype=np.int64)
+    which_detector = _assign_channel_ranges(records, channel_ranges)
+    return _split_by_detector(records, which_detector, len(channel_ranges))
 
-    # First loop to count number of records per detector
+
+@numba.njit(nogil=True, cache=True)
+def _channel_range_index(record, channel_ranges):
+    """Return the index of the channel range the record belongs to"""
+    for d_i in range(len(channel_ranges)):
+        left, right = channel_ranges[d_i]
+        if record['channel'] > right:
+            continue
+        elif record['channel'] >= left:
+            return d_i
+        else:
+            # channel_ranges should be sorted ascending.
+            break
+    print(record['time'], record['channel'], channel_ranges)
+    raise ValueError("Bad data from DAQ: data in unknown channel!")
+
+
+@numba.njit(nogil=True, cache=True)
+def _assign_channel_ranges(records, channel_ranges):
+    which_detector = np.zeros(len(records), dtype=np.int8)
     for r_i, r in enumerate(records):
-        for d_i in range(n_subdetectors):
-            left, right = channel_ranges[d_i]
-            if r['channel'] > right:
-                continue
-            elif r['channel'] >= left:
-                which_detector[r_i] = d_i
-                n_in_detector[d_i] += 1
-                break
-            else:
-                # channel_ranges should be sorted ascending.
-                print(r['time'], r['channel'], channel_ranges)
-                raise ValueError(
-                    "Bad data from DAQ: data in unknown channel!")
+        which_detector[r_i] = _channel_range_index(r, channel_ranges)
+    return which_detector
+
+
+@numba.njit(nogil=True, cache=True)
+def _split_by_detector(records, which_detector, n_subdetectors):
+    n_in_detector = np.zeros(n_subdetectors, dtype=np.int64)
+    for d_i in which_detector:
+        n_in_detector[d_i] += 1
 
     # Allocate memory
     results = numba.typed.List()
     for d_i in range(n_subdetectors):
         results.append(np.empty(n_in_detector[d_i], dtype=records.dtype))
 
-    # Second loop to fill results
     # This is slightly faster than using which_detector == d_i masks,
     # since it only needs one loop over the data.
     n_placed = np.zeros(n_subdetectors, dtype=np.int64)
@@ -415,3 +963,111 @@ def split_channel_ranges(records, channel_ranges):
         n_placed[d_i] += 1
 
     return results
+
+
+@export
+def merge_sorted_records(records_list, channel_ranges):
+    """Merge arrays of records that are each sorted by (time, channel)
+
+    Replaces concatenating and sorting the arrays. While merging, also
+    assign the records to channel_ranges (see split_channel_ranges).
+
+    :param records_list: list of record arrays, each sorted by time
+        and channel, e.g. the files of the readout threads.
+    :param channel_ranges: array of (min, max) channel of each
+        subdetector, sorted ascending.
+    :returns: (sorted records, index of the channel range of each
+        record)
+    """
+    if not len(records_list):
+        raise ValueError("Need at least one array of records to merge")
+    dtype = records_list[0].dtype
+
+    # Numba needs all arrays in a typed list to have the same type, the
+    # arrays loaded from redax are read-only views of the file buffers.
+    to_merge = numba.typed.List()
+    for r in records_list:
+        if len(r):
+            r = r.view()
+            r.flags.writeable = False
+            to_merge.append(r)
+    if not len(to_merge):
+        return np.zeros(0, dtype=dtype), np.zeros(0, dtype=np.int8)
+
+    n_records = sum([len(r) for r in to_merge])
+    result = np.empty(n_records, dtype=dtype)
+    which_detector = np.empty(n_records, dtype=np.int8)
+    if not _merge_sorted_records(to_merge, channel_ranges,
+                                 result, which_detector):
+        # Some file is only sorted by time, not by time and channel
+        result = strax.sort_by_time(np.concatenate(records_list))
+        which_detector = _assign_channel_ranges(result, channel_ranges)
+    return result, which_detector
+
+
+@numba.njit(nogil=True, cache=True)
+def _merge_sorted_records(records_list, channel_ranges,
+                          result, which_detector):
+    """K-way merge of records_list into result using a binary heap of
+    the first unmerged record of each array.
+
+    :returns: False if one of the arrays turns out to be unsorted, in
+        which case result is garbage.
+    """
+    n_arrays = len(records_list)
+    next_i = np.zeros(n_arrays, dtype=np.int64)
+    head_time = np.zeros(n_arrays, dtype=np.int64)
+    head_channel = np.zeros(n_arrays, dtype=np.int64)
+    heap = np.arange(n_arrays)
+    for a_i in range(n_arrays):
+        head_time[a_i] = records_list[a_i][0]['time']
+        head_channel[a_i] = records_list[a_i][0]['channel']
+
+    n_heap = n_arrays
+    for pos in range(n_heap // 2 - 1, -1, -1):
+        _sift_down(heap, n_heap, pos, head_time, head_channel)
+
+    for out_i in range(len(result)):
+        a_i = heap[0]
+        r = records_list[a_i][next_i[a_i]]
+        result[out_i] = r
+        which_detector[out_i] = _channel_range_index(r, channel_ranges)
+        next_i[a_i] += 1
+
+        if next_i[a_i] < len(records_list[a_i]):
+            r = records_list[a_i][next_i[a_i]]
+            if (r['time'] < head_time[a_i]
+                    or (r['time'] == head_time[a_i]
+                        and r['channel'] < head_channel[a_i])):
+                return False
+            head_time[a_i] = r['time']
+            head_channel[a_i] = r['channel']
+        else:
+            # This array is exhausted
+            n_heap -= 1
+            heap[0] = heap[n_heap]
+        _sift_down(heap, n_heap, 0, head_time, head_channel)
+    return True
+
+
+@numba.njit(nogil=True, cache=True)
+def _sift_down(heap, n_heap, pos, head_time, head_channel):
+    while True:
+        child = 2 * pos + 1
+        if child >= n_heap:
+            return
+        if (child + 1 < n_heap
+                and _head_before(heap[child + 1], heap[child],
+                                 head_time, head_channel)):
+            child += 1
+        if not _head_before(heap[child], heap[pos], head_time, head_channel):
+            return
+        heap[pos], heap[child] = heap[child], heap[pos]
+        pos = child
+
+
+@numba.njit(nogil=True, cache=True)
+def _head_before(a_i, b_i, head_time, head_channel):
+    return (head_time[a_i] < head_time[b_i]
+            or (head_time[a_i] == head_time[b_i]
+                and head_channel[a_i] < head_channel[b_i]))
@@ -1,9 +1,12 @@
+import warnings
+
 import numba
 import numpy as np
 
 import strax
 import straxen
 from .pulse_processing import HITFINDER_OPTIONS, HITFINDER_OPTIONS_he, HE_PREAMBLE
+from .pulse_processing import hit_max_sample, stored_hits_to_hits
 from strax.processing.general import _touching_windows
 
 export, __all__ = strax.exporter()
@@ -108,18 +111,34 @@ class Peaklets(strax.Plugin):
                                        self.config['n_tpc_pmts'])
 
     def compute(self, records, start, end):
-        r = records
-
         hits = strax.find_hits(
-            r,
+            records,
             min_amplitude=straxen.hit_min_amplitude(
                 self.config['hit_min_amplitude']))
+        return self.compute_from_hits(records, hits, start, end)
+
+    def compute_from_hits(self, records, hits, start, end, max_sample=None):
+        """Compute peaklets and lone_hits from records and the hits
+        found in them
+
+        :param max_sample: index of the maximum sample of the hits, if
+            known. Computed from the records if not given.
+        """
+        r = records
 
         # Remove hits in zero-gain channels
         # they should not affect the clustering!
-        hits = hits[self.to_pe[hits['channel']] != 0]
-
-        hits = strax.sort_by_time(hits)
+        has_gain = self.to_pe[hits['channel']] != 0
+        hits = hits[has_gain]
+        if max_sample is not None:
+            max_sample = max_sample[has_gain]
+
+        if max_sample is not None:
+            # Same order as strax.sort_by_time
+            order = np.lexsort((hits['channel'], hits['time']))
+            hits, max_sample = hits[order], max_sample[order]
+        else:
+            hits = strax.sort_by_time(hits)
 
         # Use peaklet gap threshold for initial clustering
         # based on gaps between hits
@@ -176,9 +195,18 @@ class Peaklets(strax.Plugin):
         # (a) doing hitfinding yet again (or storing hits)
         # (b) increase strax memory usage / max_messages,
         #     possibly due to its currently primitive scheduling.
+        if max_sample is None:
+            max_sample = hit_max_sample(records, hits)
+        elif self.config['saturation_correction_on']:
+            # The correction changes the waveforms of saturated channels
+            saturated = np.any(peaklets['saturated_channel'] > 0, axis=0)
+            redo = np.nonzero(saturated[hits['channel']])[0]
+            if len(redo):
+                max_sample = max_sample.copy()
+                max_sample[redo] = hit_max_sample(records, hits[redo])
         hit_max_times = np.sort(
             hits['time']
-            + hits['dt'] * hit_max_sample(records, hits))
+            + hits['dt'] * max_sample)
         peaklet_max_times = (
                 peaklets['time']
                 + np.argmax(peaklets['data'], axis=1) * peaklets['dt'])
@@ -385,6 +413,33 @@ def _peak_saturation_correction_inner(channel_saturated, records, p,
                 r['area'] = np.sum(r['data'])
 
 
+@export
+class PeakletsFromHits(Peaklets):
+    """Peaklets from the hits stored by PulseProcessing, instead of
+    finding the hits in the records again. Register this plugin instead
+    of Peaklets to use it.
+
+    Records and hits both come from PulseProcessing, which strax cannot
+    feed to one plugin in lazy mode. Process with allow_lazy=False in
+    the context config, or with max_workers > 1.
+    """
+    depends_on = ('records', 'hits')
+    __version__ = '0.0.1'
+
+    def compute(self, records, hits, start, end):
+        if len(hits) and (
+                hits['record_i'].max() >= len(records)
+                or np.any(records['channel'][hits['record_i']] != hits['channel'])):
+            # The hits do not belong to these records, e.g. records
+            # were processed again with other options
+            warnings.warn('Stored hits do not match the records, '
+                          'finding hits again')
+            return super().compute(records, start, end)
+        hits, max_sample = stored_hits_to_hits(hits)
+        return self.compute_from_hits(records, hits, start, end,
+                                      max_sample=max_sample)
+
+
 @export
 @strax.takes_config(
     strax.Option('n_he_pmts', track=False, default=752,
@@ -694,14 +749,3 @@ def get_tight_coin(hit_max_times, peak_max_times, left, right):
                 break
 
     return n_coin
-
-
-@numba.njit(cache=True, nogil=True)
-def hit_max_sample(records, hits):
-    """Return the index of the maximum sample for hits"""
-    result = np.zeros(len(hits), dtype=np.int16)
-    for i, h in enumerate(hits):
-        r = records[h['record_i']]
-        w = r['data'][h['left']:h['right']]
-        result[i] = np.argmax(w)
-    return result
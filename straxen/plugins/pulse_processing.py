@@ -100,6 +100,7 @@ class PulseProcessing(strax.Plugin):
      - (tpc) records
      - aqmon_records
      - pulse_counts
+     - hits
 
     For TPC records, apply basic processing:
         1. Flip, baseline, and integrate the waveform
@@ -111,6 +112,10 @@ class PulseProcessing(strax.Plugin):
     number of recorded pulses, lone_pulses (pulses which do not
     overlap with any other pulse), or mean values of baseline and
     baseline rms channel.
+
+    hits are the hits in the records, so PeakletsFromHits does not have
+    to find them again. Their record_i refers to the records of the
+    same chunk.
     """
     __version__ = '0.2.3'
 
@@ -118,12 +123,13 @@ class PulseProcessing(strax.Plugin):
     rechunk_on_save = immutabledict(
         records=False,
         veto_regions=True,
+        hits=False,
         pulse_counts=True)
     compressor = 'lz4'
 
     depends_on = 'raw_records'
 
-    provides = ('records', 'veto_regions', 'pulse_counts')
+    provides = ('records', 'veto_regions', 'hits', 'pulse_counts')
     data_kind = {k: k for k in provides}
     save_when = strax.SaveWhen.TARGET
 
@@ -137,6 +143,7 @@ class PulseProcessing(strax.Plugin):
             if 'records' in p:
                 dtype[p] = strax.record_dtype(self.record_length)
         dtype['veto_regions'] = strax.hit_dtype
+        dtype['hits'] = hits_dtype()
         dtype['pulse_counts'] = pulse_count_dtype(self.config['n_tpc_pmts'])
 
         return dtype
@@ -151,35 +158,45 @@ class PulseProcessing(strax.Plugin):
                                            self.config['n_tpc_pmts'])
         
     def compute(self, raw_records, start, end):
+        return self.process_pulses(
+            raw_records, start, end,
+            n_channels=self.config['n_tpc_pmts'],
+            hit_min_amplitude=self.config['hit_min_amplitude'],
+            hev_enabled=self.hev_enabled)
+
+    def process_pulses(self, raw_records, start, end,
+                       n_channels, hit_min_amplitude, hev_enabled):
+        """Process the raw_records of one detector, see the docstring of
+        the class
+
+        :param n_channels: number of channels, records in channels above
+            are thrown away
+        :param hit_min_amplitude: hitfinder threshold model, see
+            straxen.hit_min_amplitude
+        :param hev_enabled: whether to apply the software HE veto
+        """
         if self.config['check_raw_record_overlaps']:
-            check_overlaps(raw_records, n_channels=3000)
+            check_overlaps(raw_records)
 
         # Throw away any non-TPC records; this should only happen for XENON1T
         # converted data
-        raw_records = raw_records[
-            raw_records['channel'] < self.config['n_tpc_pmts']]
-
-        # Convert everything to the records data type -- adds extra fields.
-        r = strax.raw_to_records(raw_records)
+        raw_records = raw_records[raw_records['channel'] < n_channels]
+
+        # Convert everything to the records data type, zero the samples
+        # out of bounds (do not trust the DAQ to do so), baseline and
+        # integrate, all in one pass over the data.
+        r = prepare_records(
+            raw_records,
+            baseline_samples=self.config['baseline_samples'],
+            allow_sloppy_chunking=self.config['allow_sloppy_chunking'],
+            flip=True)
         del raw_records
 
-        # Do not trust in DAQ + strax.baseline to leave the
-        # out-of-bounds samples to zero.
-        # TODO: better to throw an error if something is nonzero
-        strax.zero_out_of_bounds(r)
-
-        strax.baseline(r,
-                       baseline_samples=self.config['baseline_samples'],
-                       allow_sloppy_chunking=self.config['allow_sloppy_chunking'],
-                       flip=True)
-
-        strax.integrate(r)
-
-        pulse_counts = count_pulses(r, self.config['n_tpc_pmts'])
+        pulse_counts = count_pulses(r, n_channels)
         pulse_counts['time'] = start
         pulse_counts['endtime'] = end
 
-        if len(r) and self.hev_enabled:
+        if len(r) and hev_enabled:
 
             r, r_vetoed, veto_regions = software_he_veto(
                 r, self.to_pe, end,
@@ -202,8 +219,7 @@ class PulseProcessing(strax.Plugin):
             # -- before filtering,since this messes with the with the S/N
             hits = strax.find_hits(
                 r,
-                min_amplitude=straxen.hit_min_amplitude(
-                    self.config['hit_min_amplitude']))
+                min_amplitude=straxen.hit_min_amplitude(hit_min_amplitude))
 
             if self.config['pmt_pulse_filter']:
                 # Filter to concentrate the PMT pulses
@@ -215,12 +231,25 @@ class PulseProcessing(strax.Plugin):
                                        left_extension=le,
                                        right_extension=re)
 
-            # Probably overkill, but just to be sure...
-            strax.zero_out_of_bounds(r)
+            if self.config['pmt_pulse_filter']:
+                # The filter can leak into the samples out of bounds,
+                # which cut_outside_hits may copy. Without a filter
+                # these samples are still zero from prepare_records.
+                strax.zero_out_of_bounds(r)
+
+                # Peaklets finds hits in the filtered records, so these
+                # are the hits to store. Without a filter the hits
+                # found above are the same.
+                hits = strax.find_hits(
+                    r,
+                    min_amplitude=straxen.hit_min_amplitude(hit_min_amplitude))
+        else:
+            hits = np.zeros(0, dtype=strax.hit_dtype)
 
         return dict(records=r,
                     pulse_counts=pulse_counts,
-                    veto_regions=veto_regions)
+                    veto_regions=veto_regions,
+                    hits=hits_to_store(r, hits))
 
     
 @export
@@ -251,14 +280,200 @@ class PulseProcessingHighEnergy(PulseProcessing):
 
     def setup(self):
         self.hev_enabled = False
-        self.config['n_tpc_pmts'] = self.config['n_he_pmts']
-        self.config['hit_min_amplitude'] = self.config['hit_min_amplitude_he']
 
     def compute(self, raw_records_he, start, end):
-        result = super().compute(raw_records_he, start, end)
+        result = self.process_pulses(
+            raw_records_he, start, end,
+            n_channels=self.config['n_he_pmts'],
+            hit_min_amplitude=self.config['hit_min_amplitude_he'],
+            hev_enabled=False)
         return dict(records_he=result['records'],
                     pulse_counts_he=result['pulse_counts'])
 
+
+@export
+@strax.takes_config(
+    strax.Option('n_he_pmts', track=False, default=752,
+                 help="Maximum channel of the he channels"),
+    *HITFINDER_OPTIONS_he)
+class PulseProcessingJoint(PulseProcessing):
+    """PulseProcessing and PulseProcessingHighEnergy in one plugin
+
+    Processes the raw_records and raw_records_he of a chunk in one
+    call, which saves scheduling a second plugin (and with
+    multiprocessing, sending a second task to a worker) for every
+    chunk. Register this plugin instead of both to use it; the
+    records and records_he are the same.
+
+    raw_records and raw_records_he both come from the DAQReader, which
+    strax cannot feed to one plugin in lazy mode. Process with
+    allow_lazy=False in the context config, or with max_workers > 1.
+    """
+    __version__ = '0.0.1'
+    depends_on = ('raw_records', 'raw_records_he')
+    provides = ('records', 'veto_regions', 'hits',
+                'records_he', 'pulse_counts_he', 'pulse_counts')
+    data_kind = {k: k for k in provides}
+    rechunk_on_save = immutabledict(
+        records=False,
+        veto_regions=True,
+        hits=False,
+        records_he=False,
+        pulse_counts_he=True,
+        pulse_counts=True)
+
+    def infer_dtype(self):
+        dtype = super().infer_dtype()
+        dtype['records_he'] = strax.record_dtype(
+            strax.record_length_from_dtype(
+                self.deps['raw_records_he'].dtype_for('raw_records_he')))
+        dtype['pulse_counts_he'] = pulse_count_dtype(self.config['n_he_pmts'])
+        return dtype
+
+    def compute(self, raw_records, raw_records_he, start, end):
+        result = super().compute(raw_records, start, end)
+        result_he = self.process_pulses(
+            raw_records_he, start, end,
+            n_channels=self.config['n_he_pmts'],
+            hit_min_amplitude=self.config['hit_min_amplitude_he'],
+            hev_enabled=False)
+        result['records_he'] = result_he['records']
+        result['pulse_counts_he'] = result_he['pulse_counts']
+        return result
+
+##
+# Hits
+##
+
+
+@export
+def hits_dtype():
+    """Hits stored by PulseProcessing: strax.hit_dtype without the
+    integration bounds (these are only set for lone hits) and with the
+    index of the maximum sample
+    """
+    return [(field, t) for field, t in strax.hit_dtype
+            if field[1] not in ('left_integration', 'right_integration')
+            ] + [(('Index of the maximum sample in the hit, from its left',
+                   'max_sample'), np.int16)]
+
+
+@export
+def hits_to_store(records, hits):
+    """Convert hits found in records to the hits_dtype"""
+    result = np.zeros(len(hits), dtype=hits_dtype())
+    for name in result.dtype.names:
+        if name != 'max_sample':
+            result[name] = hits[name]
+    result['max_sample'] = hit_max_sample(records, hits)
+    return result
+
+
+@export
+def stored_hits_to_hits(stored_hits):
+    """Convert hits of the hits_dtype back to strax.hit_dtype
+
+    :returns: (hits, max_sample)
+    """
+    hits = np.zeros(len(stored_hits), dtype=strax.hit_dtype)
+    for name in stored_hits.dtype.names:
+        if name != 'max_sample':
+            hits[name] = stored_hits[name]
+    return hits, stored_hits['max_sample']
+
+
+@numba.njit(cache=True, nogil=True)
+def hit_max_sample(records, hits):
+    """Return the index of the maximum sample for hits"""
+    result = np.zeros(len(hits), dtype=np.int16)
+    for i, h in enumerate(hits):
+        r = records[h['record_i']]
+        w = r['data'][h['left']:h['right']]
+        result[i] = np.argmax(w)
+    return result
+
+
+##
+# Record preparation
+##
+
+
+@export
+def prepare_records(raw_records, baseline_samples=40, flip=True,
+                    allow_sloppy_chunking=False, fallback_baseline=16000):
+    """Convert raw_records to baselined and integrated records
+
+    Does the same as strax.raw_to_records, strax.zero_out_of_bounds,
+    strax.baseline and strax.integrate, with identical results, but
+    goes over the data only once. See strax.baseline for the
+    arguments.
+    """
+    records = np.empty(
+        len(raw_records),
+        dtype=strax.record_dtype(
+            strax.record_length_from_dtype(raw_records.dtype)))
+    if len(raw_records):
+        _prepare_records(raw_records, records,
+                         baseline_samples=baseline_samples,
+                         flip=flip,
+                         allow_sloppy_chunking=allow_sloppy_chunking,
+                         fallback_baseline=fallback_baseline)
+    return records
+
+
+@numba.njit(cache=True, nogil=True)
+def _prepare_records(raw_records, records, baseline_samples, flip,
+                     allow_sloppy_chunking, fallback_baseline):
+    samples_per_record = len(records[0]['data'])
+    sign = -1 if flip else 1
+
+    # Last baseline (mean, rms) seen in each channel, as in strax.baseline
+    n_channels = raw_records['channel'].max() + 1
+    last_bl_in = np.zeros((n_channels, 2), dtype=np.float32)
+    seen_first = np.zeros(n_channels, dtype=np.bool_)
+
+    for r_i in range(len(raw_records)):
+        rr = raw_records[r_i]
+        r = records[r_i]
+        ch = rr['channel']
+        length = rr['length']
+
+        r['time'] = rr['time']
+        r['length'] = length
+        r['dt'] = rr['dt']
+        r['channel'] = ch
+        r['pulse_length'] = rr['pulse_length']
+        r['record_i'] = rr['record_i']
+        r['reduction_level'] = 0
+        r['amplitude_bit_shift'] = 0
+        for i in range(samples_per_record):
+            r['data'][i] = rr['data'][i] if i < length else 0
+
+        if rr['record_i'] == 0:
+            seen_first[ch] = True
+            w = r['data'][:baseline_samples]
+            last_bl_in[ch] = bl, rms = w.mean(), w.std()
+        else:
+            bl, rms = last_bl_in[ch]
+            if not seen_first[ch]:
+                if not allow_sloppy_chunking:
+                    print(rr['time'], ch, rr['record_i'])
+                    raise RuntimeError("Cannot baseline, missing 0th fragment!")
+                bl = last_bl_in[ch] = fallback_baseline
+                rms = np.nan
+        int_bl = int(bl)
+        r['baseline'] = bl
+        r['baseline_rms'] = rms
+
+        data_sum = 0
+        for i in range(length):
+            r['data'][i] = sign * (r['data'][i] - int_bl)
+            data_sum += r['data'][i]
+        r['area'] = (data_sum
+                     # Add floating part of baseline * number of samples
+                     + int(round((r['baseline'] % 1) * r['length'])))
+
+
 ##
 # Software HE Veto
 ##
@@ -304,27 +519,12 @@ def software_he_veto(records, to_pe, chunk_end,
     veto_length = np.ceil(veto_length / veto_res).astype(np.int) * veto_res
     veto_n = int(veto_length / veto_res) + 1
 
-    # 1. Find large peaks in the data.
-    # This will actually return big agglomerations of peaks and their tails
-    peaks = strax.find_peaks(
-        records, to_pe,
-        gap_threshold=1,
-        left_extension=0,
-        right_extension=0,
-        min_channels=100,
-        min_area=area_threshold,
-        result_dtype=strax.peak_dtype(n_channels=len(to_pe),
-                                      n_sum_wv_samples=veto_n))
-
-    # 2a. Set 'candidate regions' at these peaks. These should:
-    #  - Have a fixed maximum length (else we can't use the strax hitfinder on them)
-    #  - Never extend beyond the current chunk
-    #  - Do not overlap
-    veto_start = peaks['time']
-    veto_end = np.clip(peaks['time'] + veto_length,
-                       None,
-                       chunk_end)
-    veto_end[:-1] = np.clip(veto_end[:-1], None, veto_start[1:])
+    # 1. Find large peaks in the data, and
+    # 2a. set 'candidate regions' at these peaks.
+    veto_start, veto_end = he_veto_candidates(
+        records, to_pe, chunk_end,
+        veto_length=veto_length,
+        area_threshold=area_threshold)
 
     # 2b. Convert these into strax record-like objects
     # Note the waveform is float32 though (it's a summed waveform)
@@ -373,6 +573,107 @@ def software_he_veto(records, to_pe, chunk_end,
     veto_mask = strax.fully_contained_in(records, veto) == -1
     return tuple(list(mask_and_not(records, veto_mask)) + [veto])
 
+@export
+def he_veto_candidates(records, to_pe, chunk_end,
+                       veto_length=int(3e6),
+                       area_threshold=int(1e5),
+                       min_channels=100):
+    """Return (start, end) of the candidate veto regions: veto_length
+    (time in ns) after each large peak in records.
+
+    The peaks are big agglomerations of records and their tails: records
+    separated by less than 1 ns are clustered, like strax.find_peaks with
+    gap_threshold=1 does, but we only keep track of the start time and
+    the area of the clusters, and which channels contribute.
+
+    The regions:
+     - Have a fixed maximum length (else we can't use the strax
+       hitfinder on them)
+     - Never extend beyond the current chunk
+     - Do not overlap
+
+    :param records: PMT records
+    :param to_pe: ADC to PE conversion factors for the channels in records.
+    :param chunk_end: Endtime of chunk to set as maximum ceiling for the
+    veto period
+    :param veto_length: Time in ns to veto after the peak
+    :param area_threshold: Minimum peak area (PE) to trigger the veto.
+    :param min_channels: Minimum number of channels contributing to
+    the peak.
+    """
+    veto_start = _large_cluster_starts(records, to_pe,
+                                       min_area=area_threshold,
+                                       min_channels=min_channels)
+    veto_end = np.clip(veto_start + veto_length, None, chunk_end)
+    veto_end[:-1] = np.clip(veto_end[:-1], None, veto_start[1:])
+    return veto_start, veto_end
+
+
+@numba.njit(cache=True, nogil=True)
+def _large_cluster_starts(records, to_pe, min_area, min_channels):
+    """Return start times of clusters of records with at least min_area
+    PE in at least min_channels channels.
+
+    Clusters and selects exactly like strax.find_peaks with
+    gap_threshold=1 and no extensions, including the float32
+    precision of the area sums.
+    """
+    result = np.empty(len(records), dtype=np.int64)
+    n_found = 0
+
+    n_channels = len(to_pe)
+    area_per_channel = np.zeros(n_channels, dtype=np.float32)
+    # Channels that contribute to the current cluster, so we only
+    # have to reset those when starting a new one
+    in_cluster = np.zeros(n_channels, dtype=np.bool_)
+    cluster_channels = np.zeros(n_channels, dtype=np.int64)
+    n_cluster_channels = 0
+
+    in_peak = False
+    start = 0
+    endtime = 0
+    area = np.float32(0)
+    for r_i in range(len(records)):
+        r = records[r_i]
+        t1 = r['time'] + r['dt'] * r['length']
+        if not in_peak:
+            for i in range(n_cluster_channels):
+                ch = cluster_channels[i]
+                area_per_channel[ch] = 0
+                in_cluster[ch] = False
+            n_cluster_channels = 0
+            start = r['time']
+            endtime = t1
+            area = np.float32(0)
+            in_peak = True
+
+        endtime = max(endtime, t1)
+        ch = r['channel']
+        area_pe = r['area'] * to_pe[ch]
+        area_per_channel[ch] += area_pe
+        area = np.float32(area + area_pe)
+        if not in_cluster[ch]:
+            in_cluster[ch] = True
+            cluster_channels[n_cluster_channels] = ch
+            n_cluster_channels += 1
+
+        if (r_i == len(records) - 1
+                or records[r_i + 1]['time'] - endtime >= 1):
+            in_peak = False
+            if area < min_area:
+                continue
+            n_contributing = 0
+            for i in range(n_cluster_channels):
+                if area_per_channel[cluster_channels[i]] != 0:
+                    n_contributing += 1
+            if n_contributing < min_channels:
+                continue
+            result[n_found] = start
+            n_found += 1
+
+    return result[:n_found]
+
+
 @numba.njit(cache=True, nogil=True)
 def rough_sum(regions, records, to_pe, n, dt):
     """Compute ultra-rough sum waveforms for regions, assuming:
@@ -434,72 +735,154 @@ def pulse_count_dtype(n_channels):
     ]
 
 
-def count_pulses(records, n_channels):
-    """Return array with one element, with pulse count info from records"""
-    if len(records):
-        result = np.zeros(1, dtype=pulse_count_dtype(n_channels))
-        _count_pulses(records, n_channels, result)
-        return result
-    return np.zeros(0, dtype=pulse_count_dtype(n_channels))
+def count_pulses(records, n_channels, n_shards=None):
+    """Return array with one element, with pulse count info from records
+
+    :param n_shards: number of ranges of records to count in parallel,
+        defaults to the number of numba threads
+    """
+    if not len(records):
+        return np.zeros(0, dtype=pulse_count_dtype(n_channels))
+    if records['channel'].max() >= n_channels:
+        raise RuntimeError(f"Out of bounds channel {records['channel'].max()} "
+                           f"in get_counts!")
+
+    n_shards = _n_shards(len(records), n_shards)
+    bounds = _shard_bounds(len(records), n_shards)
+    # Integer and float sums per shard and channel, see _COUNT_FIELDS
+    # and _BASELINE_FIELDS. The kernels take views of the record
+    # fields, so they need not be compiled for every record length.
+    counts = np.zeros((n_shards, len(_COUNT_FIELDS), n_channels),
+                      dtype=np.int64)
+    baselines = np.zeros((n_shards, len(_BASELINE_FIELDS), n_channels),
+                         dtype=np.float64)
+    in_lone_pulse = np.full((n_shards, n_channels), -1, dtype=np.int8)
+    _count_pulses(records['time'], records['channel'], records['record_i'],
+                  records['pulse_length'], records['dt'], records['area'],
+                  records['baseline'], records['baseline_rms'],
+                  bounds, counts, baselines, in_lone_pulse)
+    counts = _add_carried_lone_area(counts, in_lone_pulse).sum(axis=0)
+    baselines = baselines.sum(axis=0)
+
+    result = np.zeros(1, dtype=pulse_count_dtype(n_channels))
+    res = result[0]
+    for field_i, field in enumerate(_COUNT_FIELDS[:4]):
+        res[field][:] = counts[field_i]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # The sums of float32 values are exact in float64, so the order
+        # of summation does not matter
+        means = baselines[0] / counts[0]
+        rms_means = baselines[1] / counts[0]
+    means[np.isnan(means)] = NO_PULSE_COUNTS
+    res['baseline_mean'][:] = means
+    res['baseline_rms_mean'][:] = rms_means
+    return result
 
 
 NO_PULSE_COUNTS = -9999  # Special value required by average_baseline in case counts = 0
+_COUNT_FIELDS = ('pulse_count', 'lone_pulse_count',
+                 'pulse_area', 'lone_pulse_area',
+                 'carried_area')
+_BASELINE_FIELDS = ('baseline', 'baseline_rms')
+
+
+@numba.njit(cache=True, nogil=True, parallel=True)
+def _count_pulses(time, channel, record_i, pulse_length, dt, area,
+                  baseline, baseline_rms,
+                  bounds, counts, baselines, in_lone_pulse):
+    """Count pulses in ranges of records in parallel, filling the rows
+    of counts, baselines and in_lone_pulse of each range (shard)
+
+    A pulse is lone if it starts after all earlier pulses ended, and
+    ends before the next record starts. in_lone_pulse tracks if the
+    last pulse started in a channel is lone, -1 if no pulse started in
+    the shard (yet). Fragments before the first start belong to a pulse
+    of an earlier shard, their area is kept apart as carried_area.
+    """
+    n = len(time)
+    n_shards = len(bounds) - 1
+
+    # Where the pulses in each shard end, so every shard knows where the
+    # pulses before it ended.
+    shard_end = np.zeros(n_shards, dtype=np.int64)
+    for k in numba.prange(n_shards):
+        for r_i in range(bounds[k], bounds[k + 1]):
+            if record_i[r_i] == 0:
+                shard_end[k] = max(shard_end[k],
+                                   time[r_i] + pulse_length[r_i] * dt[r_i])
+
+    for k in numba.prange(n_shards):
+        last_end_seen = 0
+        for k_before in range(k):
+            last_end_seen = max(last_end_seen, shard_end[k_before])
+        c = counts[k]
+        lone = in_lone_pulse[k]
+
+        for r_i in range(bounds[k], bounds[k + 1]):
+            if r_i != n - 1:
+                next_start = time[r_i + 1]
+            elif n > 1:
+                next_start = time[r_i]
+            else:
+                next_start = 0
+
+            ch = channel[r_i]
+            pulse_end = time[r_i] + pulse_length[r_i] * dt[r_i]
+            c[2, ch] += area[r_i]  # <-- Summing total area in channel
+
+            if record_i[r_i] == 0:
+                c[0, ch] += 1
+                baselines[k, 0, ch] += baseline[r_i]
+                baselines[k, 1, ch] += baseline_rms[r_i]
+
+                if time[r_i] > last_end_seen and pulse_end < next_start:
+                    # This is a lone pulse
+                    c[1, ch] += 1
+                    lone[ch] = 1
+                    c[3, ch] += area[r_i]
+                else:
+                    lone[ch] = 0
+
+                last_end_seen = max(last_end_seen, pulse_end)
+
+            elif lone[ch] == 1:
+                # This is a subsequent fragment of a lone pulse
+                c[3, ch] += area[r_i]
+
+            elif lone[ch] == -1:
+                c[4, ch] += area[r_i]
+
+
 @numba.njit(cache=True, nogil=True)
-def _count_pulses(records, n_channels, result):
-    count = np.zeros(n_channels, dtype=np.int64)
-    lone_count = np.zeros(n_channels, dtype=np.int64)
-    area = np.zeros(n_channels, dtype=np.int64)
-    lone_area = np.zeros(n_channels, dtype=np.int64)
-
-    last_end_seen = 0
-    next_start = 0
-
-    # Array of booleans to track whether we are currently in a lone pulse
-    # in each channel
-    in_lone_pulse = np.zeros(n_channels, dtype=np.bool_)
-    baseline_buffer = np.zeros(n_channels, dtype=np.float64)
-    baseline_rms_buffer = np.zeros(n_channels, dtype=np.float64)
-    for r_i, r in enumerate(records):
-        if r_i != len(records) - 1:
-            next_start = records[r_i + 1]['time']
+def _add_carried_lone_area(counts, in_lone_pulse):
+    """Add the fragments of lone pulses that started in earlier shards
+    to the lone pulse area
+    """
+    n_shards, n_channels = in_lone_pulse.shape
+    in_lone = np.zeros(n_channels, dtype=np.bool_)
+    for k in range(n_shards):
+        for ch in range(n_channels):
+            if in_lone[ch]:
+                counts[k, 3, ch] += counts[k, 4, ch]
+            if in_lone_pulse[k, ch] != -1:
+                in_lone[ch] = in_lone_pulse[k, ch] == 1
+    return counts
 
-        ch = r['channel']
-        if ch >= n_channels:
-            print('Channel:', ch)
-            raise RuntimeError("Out of bounds channel in get_counts!")
-
-        area[ch] += r['area']  # <-- Summing total area in channel
-
-        if r['record_i'] == 0:
-            count[ch] += 1
-            baseline_buffer[ch] += r['baseline']
-            baseline_rms_buffer[ch] += r['baseline_rms'] 
-
-            if (r['time'] > last_end_seen
-                    and r['time'] + r['pulse_length'] * r['dt'] < next_start):
-                # This is a lone pulse
-                lone_count[ch] += 1
-                in_lone_pulse[ch] = True
-                lone_area[ch] += r['area']
-            else:
-                in_lone_pulse[ch] = False
 
-            last_end_seen = max(last_end_seen,
-                                r['time'] + r['pulse_length'] * r['dt'])
+def _n_shards(n_records, n_shards=None):
+    """Number of ranges of records to process in parallel"""
+    if n_shards is None:
+        n_shards = numba.get_num_threads()
+    return max(1, min(n_shards, n_records))
 
-        elif in_lone_pulse[ch]:
-            # This is a subsequent fragment of a lone pulse
-            lone_area[ch] += r['area']
 
-    res = result[0]
-    res['pulse_count'][:] = count[:]
-    res['lone_pulse_count'][:] = lone_count[:]
-    res['pulse_area'][:] = area[:]
-    res['lone_pulse_area'][:] = lone_area[:]
-    means = (baseline_buffer/count)
-    means[np.isnan(means)] = NO_PULSE_COUNTS
-    res['baseline_mean'][:] = means[:]
-    res['baseline_rms_mean'][:] = (baseline_rms_buffer/count)[:]
+@numba.njit(cache=True, nogil=True)
+def _shard_bounds(n, n_shards):
+    """Start and end index of n_shards ranges of n items"""
+    bounds = np.zeros(n_shards + 1, dtype=np.int64)
+    for k in range(n_shards + 1):
+        bounds[k] = k * n // n_shards
+    return bounds
 
 
 ##
@@ -519,24 +902,96 @@ def channel_split(rr, first_other_ch):
 
 
 @export
-def check_overlaps(records, n_channels):
+def check_overlaps(records, n_channels=None, n_shards=None):
     """Raise a ValueError if any of the pulses in records overlap
 
     Assumes records is already sorted by time.
+
+    :param n_channels: number of channels to keep track of. If None,
+        only the channels present in records are tracked.
+    :param n_shards: number of ranges of records to check in parallel,
+        defaults to the number of numba threads
     """
-    last_end = np.zeros(n_channels, dtype=np.int64)
-    channel, time = _check_overlaps(records, last_end)
-    if channel != -9999:
+    if not len(records):
+        return
+    max_channel = records['channel'].max()
+    if n_channels is None:
+        channel_index, n_tracked = _present_channel_index(
+            records['channel'], max_channel)
+    elif max_channel >= n_channels:
+        raise ValueError(f"Channel {max_channel} out of range, "
+                         f"only {n_channels} channels are checked")
+    else:
+        channel_index = np.arange(n_channels, dtype=np.int32)
+        n_tracked = n_channels
+
+    n_shards = _n_shards(len(records), n_shards)
+    r_i, last_end = _check_overlaps(
+        records['time'], records['length'], records['dt'], records['channel'],
+        channel_index, n_tracked, _shard_bounds(len(records), n_shards))
+    if r_i != -1:
         raise ValueError(
-            f"Bad data! In channel {channel}, a pulse starts at {time}, "
-            f"BEFORE the previous pulse in that same channel ended "
-            f"(at {last_end[channel]})")
+            f"Bad data! In channel {records[r_i]['channel']}, a pulse starts "
+            f"at {records[r_i]['time']}, BEFORE the previous pulse in that "
+            f"same channel ended (at {last_end})")
 
 
 @numba.njit(cache=True, nogil=True)
-def _check_overlaps(records, last_end):
-    for r in records:
-        if r['time'] < last_end[r['channel']]:
-            return r['channel'], r['time']
-        last_end[r['channel']] = strax.endtime(r)
-    return -9999, -9999
+def _present_channel_index(channel, max_channel):
+    """Return an array that maps the channels present to 0, 1, ...,
+    and the number of channels present
+    """
+    present = np.zeros(max_channel + 1, dtype=np.bool_)
+    for ch in channel:
+        present[ch] = True
+    channel_index = np.cumsum(present).astype(np.int32) - 1
+    return channel_index, channel_index[-1] + 1
+
+
+@numba.njit(cache=True, nogil=True, parallel=True)
+def _check_overlaps(time, length, dt, channel, channel_index, n_tracked,
+                    bounds):
+    """Return the index of the first record that starts before the
+    previous one in its channel ended, and the end of that previous
+    record. Returns (-1, -1) if there are no overlaps.
+    """
+    n = len(time)
+    n_shards = len(bounds) - 1
+
+    first_i = np.full((n_shards, n_tracked), -1, dtype=np.int64)
+    last_end = np.zeros((n_shards, n_tracked), dtype=np.int64)
+    bad_i = np.full(n_shards, n, dtype=np.int64)
+    bad_end = np.zeros(n_shards, dtype=np.int64)
+
+    for k in numba.prange(n_shards):
+        for r_i in range(bounds[k], bounds[k + 1]):
+            c = channel_index[channel[r_i]]
+            if first_i[k, c] == -1:
+                # Checked against the earlier shards below
+                first_i[k, c] = r_i
+            elif time[r_i] < last_end[k, c]:
+                bad_i[k] = r_i
+                bad_end[k] = last_end[k, c]
+                break
+            last_end[k, c] = time[r_i] + length[r_i] * dt[r_i]
+
+    # Check the first record in each channel of each shard against the
+    # end of the last one in the earlier shards. If a shard stopped at an
+    # overlap, the ends of its channels are incomplete, but only records
+    # after that overlap are checked against them.
+    result_i, result_end = n, -1
+    end_before = np.zeros(n_tracked, dtype=np.int64)
+    for k in range(n_shards):
+        if bad_i[k] < result_i:
+            result_i, result_end = bad_i[k], bad_end[k]
+        for c in range(n_tracked):
+            r_i = first_i[k, c]
+            if r_i == -1:
+                continue
+            if time[r_i] < end_before[c] and r_i < result_i:
+                result_i, result_end = r_i, end_before[c]
+            end_before[c] = last_end[k, c]
+
+    if result_i == n:
+        return -1, -1
+    return result_i, result_end
@@ -0,0 +1,229 @@
+"""Synthetic redax output, to test and benchmark the DAQReader without
+replaying a real run.
+"""
+import os
+import time
+
+import numpy as np
+import strax
+
+export, __all__ = strax.exporter()
+__all__ += ['NOMINAL_TPC_RATE', 'NOMINAL_HE_RATE']
+
+# Rough per-channel pulse rate (Hz) of the TPC PMTs in background mode,
+# dominated by lone hits. Benchmarks scale this to emulate high rates.
+NOMINAL_TPC_RATE = 100
+
+# Rough per-channel pulse rate (Hz) of the attenuated high energy
+# channels, which only see large signals
+NOMINAL_HE_RATE = 10
+
+# Shape of the single PE pulse put in each DAQ pulse, in ADC counts
+# below the baseline per unit amplitude
+PE_SHAPE = np.array([0.3, 1, 0.6, 0.3, 0.1])
+
+
+@export
+def default_pulse_lengths(rng, size, minimum=80, mean_extra=80):
+    """Pulse lengths in samples: a minimum readout window extended by
+    an exponential tail, as redax does for lone hits and S1s
+
+    :param rng: numpy random generator
+    :param size: number of pulses
+    :param minimum: shortest pulse length in samples
+    :param mean_extra: mean extension beyond the minimum in samples
+    """
+    return minimum + rng.exponential(mean_extra, size=size).astype(np.int64)
+
+
+@export
+def fake_daq_records(t_start, t_end, channels, rate=NOMINAL_TPC_RATE,
+                     pulse_length=default_pulse_lengths,
+                     record_length=110, dt=10,
+                     baseline=16000, noise=3., pe_amplitude=50.,
+                     rng=None):
+    """Raw records of Poisson distributed pulses, sorted by time
+
+    Pulses in the same channel do not overlap: a new pulse can only
+    start after the previous one ended, like the digitizer's deadtime.
+    Long pulses are split over several records. Each pulse has a
+    single PE signal, so the hitfinder has something to find.
+
+    :param t_start: start of the time range (ns)
+    :param t_end: end of the time range (ns), pulses end before this
+    :param channels: array of channel numbers
+    :param rate: pulse rate per channel (Hz), a number or an array
+        with a rate for every channel
+    :param pulse_length: pulse length in samples, a number or a
+        function (rng, size) -> lengths, see default_pulse_lengths
+    :param record_length: samples per record
+    :param dt: sampling time (ns)
+    :param baseline: baseline in ADC counts
+    :param noise: standard deviation of the baseline in ADC counts
+    :param pe_amplitude: mean amplitude of the single PE signal in ADC
+        counts, the amplitude is exponentially distributed
+    :param rng: numpy random generator, or a seed for one
+    """
+    rng = np.random.default_rng(rng)
+    channels = np.asarray(channels)
+    rates = np.broadcast_to(np.asarray(rate, dtype=np.float64),
+                            channels.shape)
+    n_samples = (t_end - t_start) // dt
+
+    # Pulse start times and lengths, in samples since t_start
+    pulse_times, pulse_lengths, pulse_channels = [], [], []
+    for ch, ch_rate in zip(channels, rates):
+        if ch_rate <= 0:
+            continue
+        # Draw a few sigma more pulses than needed, then drop the
+        # pulses that do not end before t_end
+        n_expected = ch_rate * (t_end - t_start) / 1e9
+        n = int(n_expected + 5 * n_expected ** 0.5 + 5)
+        if callable(pulse_length):
+            lengths = np.asarray(pulse_length(rng, n), dtype=np.int64)
+        else:
+            lengths = np.full(n, pulse_length, dtype=np.int64)
+        gaps = rng.exponential(1e9 / ch_rate / dt, size=n).astype(np.int64)
+        # A pulse starts a gap after the end of the previous one
+        ends = np.cumsum(gaps + lengths)
+        keep = ends <= n_samples
+        pulse_times.append((ends - lengths)[keep])
+        pulse_lengths.append(lengths[keep])
+        pulse_channels.append(np.full(keep.sum(), ch))
+    if not pulse_times:
+        return np.zeros(0, dtype=strax.raw_record_dtype(record_length))
+    pulse_times = np.concatenate(pulse_times)
+    pulse_lengths = np.concatenate(pulse_lengths)
+    pulse_channels = np.concatenate(pulse_channels)
+
+    # Split the pulses into records
+    n_records = (pulse_lengths + record_length - 1) // record_length
+    record_i = (np.arange(n_records.sum())
+                - np.repeat(np.cumsum(n_records) - n_records, n_records))
+    pulse_of_record = np.repeat(np.arange(len(pulse_times)), n_records)
+
+    r = np.zeros(len(record_i), dtype=strax.raw_record_dtype(record_length))
+    r['time'] = t_start + dt * (pulse_times[pulse_of_record]
+                                + record_i * record_length)
+    r['channel'] = pulse_channels[pulse_of_record]
+    r['dt'] = dt
+    r['pulse_length'] = pulse_lengths[pulse_of_record]
+    r['record_i'] = record_i
+    r['length'] = np.minimum(record_length,
+                             r['pulse_length'] - record_i * record_length)
+
+    data = baseline + rng.normal(0, noise, size=r['data'].shape)
+    # Put the PE right after the samples used for the baseline
+    first = np.where(record_i == 0)[0]
+    amplitudes = rng.exponential(pe_amplitude, size=len(first))
+    pe_start = min(50, record_length - len(PE_SHAPE))
+    data[first, pe_start:pe_start + len(PE_SHAPE)] -= (
+            amplitudes[:, None] * PE_SHAPE[None, :])
+    data[np.arange(record_length)[None, :] >= r['length'][:, None]] = 0
+    r['data'] = np.round(data)
+    return strax.sort_by_time(r)
+
+
+@export
+def write_redax_folder(folder, records, reader_channels, compressor='lz4'):
+    """Write the files of all readout threads for one chunk folder
+
+    The files are written to a temporary folder, which is renamed when
+    all files are complete, as redax does.
+
+    :param folder: the chunk folder to write, e.g. daq_input_dir/000000
+    :param records: raw_records of the chunk, sorted by time
+    :param reader_channels: list with the channels of each readout
+        thread, each reader gets a file even if it has no data
+    :param compressor: compressor of the files, 'none' to write the
+        raw bytes
+    :returns: number of bytes written
+    """
+    temp_folder = folder + '_temp'
+    os.makedirs(temp_folder)
+    n_bytes = 0
+    for reader_i, channels in enumerate(reader_channels):
+        r = records[np.isin(records['channel'], channels)]
+        fn = os.path.join(temp_folder, f'reader_{reader_i}')
+        if compressor in (None, 'none'):
+            r.tofile(fn)
+            n_bytes += r.nbytes
+        else:
+            n_bytes += strax.save_file(fn, r, compressor=compressor)
+    os.rename(temp_folder, folder)
+    return n_bytes
+
+
+@export
+def write_fake_daq_run(daq_input_dir, n_chunks=3,
+                       chunk_duration=int(5e9),
+                       overlap_duration=int(5e8),
+                       n_channels=494,
+                       channels=None,
+                       n_readers=8,
+                       compressor='lz4',
+                       delay=0,
+                       **kwargs):
+    """Write a run of synthetic redax output to daq_input_dir
+
+    Every chunk has a central folder. The overlap data between chunks
+    is written both as the _post folder of a chunk and as the _pre
+    folder of the next one. THE_END is written at the end, with a file
+    for every readout thread.
+
+    :param daq_input_dir: folder to write to, the daq_input_dir of the
+        DAQReader
+    :param n_chunks: number of (central) chunks
+    :param chunk_duration: duration of the central chunks (ns)
+    :param overlap_duration: duration of the overlap chunks (ns)
+    :param n_channels: number of channels, starting at zero. The
+        channels are spread evenly over the readout threads.
+    :param channels: array of channel numbers, to use instead of
+        n_channels
+    :param n_readers: number of readout threads, i.e. files per folder
+    :param compressor: compressor of the files, 'none' to write the
+        raw bytes
+    :param delay: seconds to wait before writing each folder, to
+        emulate a DAQ that is still taking data
+    :param kwargs: options for fake_daq_records, e.g. rate, rng
+    :returns: dict with the number of records, the uncompressed bytes
+        of the records and the bytes written to disk
+    """
+    kwargs.setdefault('rng', 0)
+    rng = np.random.default_rng(kwargs.pop('rng'))
+    if channels is None:
+        channels = np.arange(n_channels)
+    reader_channels = np.array_split(channels, n_readers)
+    run_end = n_chunks * (chunk_duration + overlap_duration) - overlap_duration
+    records = fake_daq_records(0, run_end, channels, rng=rng, **kwargs)
+
+    os.makedirs(daq_input_dir, exist_ok=True)
+    result = dict(n_records=len(records),
+                  raw_bytes=records.nbytes,
+                  written_bytes=0)
+
+    def write(name, t_start, t_end):
+        time.sleep(delay)
+        i_start, i_end = np.searchsorted(records['time'], [t_start, t_end])
+        result['written_bytes'] += write_redax_folder(
+            os.path.join(daq_input_dir, name),
+            records[i_start:i_end],
+            reader_channels,
+            compressor=compressor)
+
+    for chunk_i in range(n_chunks):
+        t_start = chunk_i * (chunk_duration + overlap_duration)
+        t_end = t_start + chunk_duration
+        write(f'{chunk_i:06d}', t_start, t_end)
+        if chunk_i == n_chunks - 1:
+            continue
+        for name in (f'{chunk_i:06d}_post', f'{chunk_i + 1:06d}_pre'):
+            write(name, t_end, t_end + overlap_duration)
+
+    time.sleep(delay)
+    end_dir = os.path.join(daq_input_dir, 'THE_END')
+    os.makedirs(end_dir)
+    for reader_i in range(n_readers):
+        with open(os.path.join(end_dir, f'reader_{reader_i}'), mode='w') as f:
+            f.write("That's all folks!")
+    return result
@@ -33,6 +33,12 @@ def _check_pulse_count(records):
     assert len(counts) == 1
     count = counts[0]
 
+    # Counting ranges of records in parallel gives the same result,
+    # compare bit for bit to consider nans equal
+    for n_shards in (2, 3, 7):
+        assert counts.tobytes() == straxen.plugins.pulse_processing.count_pulses(
+            records, n_channels=n_ch, n_shards=n_shards).tobytes()
+
     # Check total pulse count and area
     for ch, n in enumerate(counts[0]['pulse_count']):
         rc = records[records['channel'] == ch]
@@ -0,0 +1,241 @@
+"""Test the DAQReader on synthetic redax output"""
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import strax
+import straxen
+
+run_id = '000000'
+n_readers = 4
+chunk_duration = int(1e7)
+overlap_duration = int(1e6)
+n_chunks = 3
+record_length = 110
+tpc_channels = 494
+rate = 200  # Hz per channel
+
+
+def write_fake_daq_data(daq_dir, compressor='lz4', delay=0):
+    """Write a few chunks of redax-like output to daq_dir, wait delay
+    seconds before writing each folder.
+    """
+    return straxen.write_fake_daq_run(
+        daq_dir,
+        n_chunks=n_chunks,
+        chunk_duration=chunk_duration,
+        overlap_duration=overlap_duration,
+        n_channels=tpc_channels,
+        n_readers=n_readers,
+        compressor=compressor,
+        delay=delay,
+        rate=rate,
+        record_length=record_length)
+
+
+def _daq_context(daq_dir, storage_dir, **config):
+    st = strax.Context(storage=strax.DataDirectory(storage_dir),
+                       register=straxen.DAQReader,
+                       config=dict(
+                           daq_input_dir=daq_dir,
+                           daq_chunk_duration=chunk_duration,
+                           daq_overlap_chunk_duration=overlap_duration,
+                           readout_threads={'reader': n_readers},
+                           channel_map=straxen.contexts.xnt_common_config['channel_map'],
+                           record_length=record_length,
+                           **config))
+    st.set_context_config({'free_options': tuple(st.config.keys())})
+    return st
+
+
+def _load_raw_records(write_delay=None, compressor='lz4', **config):
+    """Get raw_records from fake redax output. If write_delay is given,
+    write the data in a background thread while processing.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        daq_dir = os.path.join(temp_dir, 'daq')
+        st = _daq_context(daq_dir, os.path.join(temp_dir, 'strax_data'),
+                          daq_compressor=compressor,
+                          **config)
+        if write_delay is None:
+            write_fake_daq_data(daq_dir, compressor=compressor)
+            return st.get_array(run_id, 'raw_records')
+
+        os.makedirs(daq_dir)
+        writer = threading.Thread(target=write_fake_daq_data,
+                                  args=(daq_dir,),
+                                  kwargs=dict(delay=write_delay))
+        writer.start()
+        try:
+            return st.get_array(run_id, 'raw_records')
+        finally:
+            writer.join()
+
+
+def test_daqreader_sorted_output():
+    rr = _load_raw_records()
+    assert len(rr)
+    assert np.all(np.diff(rr['time']) >= 0)
+    assert rr['channel'].max() < tpc_channels
+
+
+def test_decompression_threads():
+    rr_serial = _load_raw_records(daq_decompression_threads=1)
+    rr_threaded = _load_raw_records(daq_decompression_threads=n_readers)
+    np.testing.assert_array_equal(rr_serial, rr_threaded)
+
+
+def test_merge_sorted_records():
+    channel_ranges = np.asarray(
+        list(straxen.contexts.xnt_common_config['channel_map'].values()))
+    channels = np.array_split(np.arange(tpc_channels), n_readers)
+    records = straxen.fake_daq_records(0, int(1e7), np.arange(tpc_channels),
+                                       rate=rate, rng=0)
+    records_list = [records[np.isin(records['channel'], ch)]
+                    for ch in channels]
+    # Empty files should not bother the merging
+    records_list.append(records_list[0][:0])
+
+    merged, which_detector = straxen.merge_sorted_records(
+        records_list, channel_ranges)
+    expected = strax.sort_by_time(np.concatenate(records_list))
+    np.testing.assert_array_equal(merged, expected)
+    np.testing.assert_array_equal(
+        which_detector,
+        straxen.plugins.daqreader._assign_channel_ranges(expected, channel_ranges))
+
+    # Files sorted by time but not by channel are sorted the slow way
+    records_list[0] = records_list[0][::-1]
+    records_list[0] = records_list[0][np.argsort(records_list[0]['time'],
+                                                 kind='stable')]
+    merged, _ = straxen.merge_sorted_records(records_list, channel_ranges)
+    np.testing.assert_array_equal(merged, expected)
+
+
+def _wait_for(condition, timeout=10):
+    t0 = time.time()
+    while not condition():
+        if time.time() - t0 > timeout:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_directory_watcher():
+    methods = ['poll']
+    if straxen.plugins.daqreader.inotify_simple is not None:
+        methods.append('inotify')
+
+    for method in methods:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            daq_dir = os.path.join(temp_dir, 'daq')
+            # The directory does not exist yet when we start watching
+            watcher = straxen.DAQDirectoryWatcher(daq_dir,
+                                                  complete_after=n_readers,
+                                                  method=method,
+                                                  poll_interval=0.05)
+            try:
+                assert watcher.files('000000') is None
+                writer = threading.Thread(target=write_fake_daq_data,
+                                          args=(daq_dir,),
+                                          kwargs=dict(delay=0.01))
+                writer.start()
+                writer.join()
+
+                def all_seen():
+                    return all(watcher.files(folder) == set(os.listdir(
+                                   os.path.join(daq_dir, folder)))
+                               for folder in os.listdir(daq_dir))
+                assert _wait_for(all_seen), method
+                assert watcher.files('000000_pre') is None
+
+                # Files written one by one straight into a folder
+                folder = os.path.join(daq_dir, '000099')
+                os.makedirs(folder)
+                for reader_i in range(n_readers):
+                    open(os.path.join(folder, f'reader_{reader_i}'), mode='w').close()
+                    assert _wait_for(all_seen), method
+
+                # Erased folders
+                shutil.rmtree(os.path.join(daq_dir, '000000'))
+                assert _wait_for(lambda: watcher.files('000000') is None), method
+            finally:
+                watcher.stop()
+
+
+def test_daqreader_live():
+    """Process data while it is being written"""
+    for method in ('auto', 'poll', None):
+        rr_live = _load_raw_records(write_delay=0.1, daq_input_watcher=method)
+        np.testing.assert_array_equal(rr_live, _load_raw_records())
+
+
+def test_prefetch():
+    rr = _load_raw_records(daq_prefetch_depth=0)
+    for depth in (1, 3):
+        np.testing.assert_array_equal(
+            rr, _load_raw_records(daq_prefetch_depth=depth))
+        np.testing.assert_array_equal(
+            rr, _load_raw_records(daq_prefetch_depth=depth, write_delay=0.1))
+
+
+def test_uncompressed_memmap():
+    np.testing.assert_array_equal(_load_raw_records(),
+                                  _load_raw_records(compressor='none'))
+
+
+def test_pickled_daqreader_does_not_prefetch():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        st = _daq_context(temp_dir, temp_dir)
+        plugin = st.get_single_plugin(run_id, 'raw_records')
+        plugin.is_ready(0)
+        assert plugin._watcher is not None
+        copy = pickle.loads(pickle.dumps(plugin))
+        assert copy._watcher is None
+        assert not copy._allow_prefetch
+        plugin.cleanup(wait_for=[])
+
+
+def test_daqreader_stats():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        daq_dir = os.path.join(temp_dir, 'daq')
+        st = _daq_context(daq_dir, os.path.join(temp_dir, 'strax_data'))
+        write_fake_daq_data(daq_dir)
+        rr = st.get_array(run_id, 'raw_records')
+        stats = st.get_array(run_id, 'daqreader_stats')
+    assert len(stats) == n_chunks
+    np.testing.assert_array_equal(stats['chunk_i'], np.arange(n_chunks))
+    # Only the tpc has data in the fake files
+    assert stats['records_out'].sum() == len(rr)
+    assert np.all(stats['bytes_in'] > 0)
+    assert np.all(stats['t_total'] > 0)
+    assert np.all(stats['mb_per_s'] > 0)
+    stage_time = sum([stats['t_' + stage]
+                      for stage in ('listing', 'merging', 'splitting')])
+    assert np.all(stage_time <= stats['t_total'])
+
+
+def test_fake_daq_records():
+    duration = int(1e8)
+    records = straxen.fake_daq_records(0, duration, np.arange(tpc_channels),
+                                       rate=rate, record_length=record_length,
+                                       rng=0)
+    assert np.all(np.diff(records['time']) >= 0)
+    assert np.all(strax.endtime(records) <= duration)
+    # Pulses in a channel may not overlap
+    straxen.check_overlaps(records, n_channels=tpc_channels)
+
+    first = records[records['record_i'] == 0]
+    expected = rate * tpc_channels * duration / 1e9
+    assert abs(len(first) - expected) < 5 * expected ** 0.5
+    assert records['length'].sum() == first['pulse_length'].sum()
+
+    # The hitfinder finds the PE in every pulse
+    r = strax.raw_to_records(records)
+    strax.baseline(r, baseline_samples=40, flip=True)
+    hits = strax.find_hits(r, min_amplitude=15)
+    assert len(np.unique(hits['record_i'])) > 0.5 * len(first)
@@ -0,0 +1,234 @@
+import tempfile
+
+import numpy as np
+import strax
+import straxen
+
+
+def _prepare_records_strax(raw_records, **kwargs):
+    """The chain of strax functions that prepare_records replaces"""
+    r = strax.raw_to_records(raw_records)
+    strax.zero_out_of_bounds(r)
+    strax.baseline(r, **kwargs)
+    strax.integrate(r)
+    return r
+
+
+def _fake_raw_records():
+    raw_records = straxen.fake_daq_records(
+        0, int(1e7), np.arange(494), rate=1000,
+        # Include pulses shorter than the baseline window
+        pulse_length=lambda rng, size: rng.integers(1, 400, size=size),
+        rng=0)
+    # Garbage out of bounds, which should be zeroed
+    rng = np.random.default_rng(1)
+    out_of_bounds = np.arange(raw_records['data'].shape[1]) >= raw_records['length'][:, None]
+    raw_records['data'][out_of_bounds] = rng.integers(
+        -2**15, 2**15, size=out_of_bounds.sum())
+    return raw_records
+
+
+def test_prepare_records():
+    raw_records = _fake_raw_records()
+    for kwargs in (dict(), dict(flip=False), dict(baseline_samples=20)):
+        r = straxen.prepare_records(raw_records, **kwargs)
+        # Compare bit for bit, np.testing would not consider nans equal
+        assert r.tobytes() == _prepare_records_strax(raw_records, **kwargs).tobytes()
+
+    r = straxen.prepare_records(raw_records[:0])
+    assert len(r) == 0
+    assert r.dtype == strax.record_dtype(110)
+
+
+def test_prepare_records_sloppy_chunking():
+    raw_records = _fake_raw_records()
+    # Start with fragments of which we miss the first record
+    missing_first = raw_records['record_i'] > 0
+    missing_first[1000:] = False
+    raw_records = raw_records[np.argmax(missing_first):]
+    assert raw_records[0]['record_i'] > 0
+
+    r = straxen.prepare_records(raw_records, allow_sloppy_chunking=True)
+    expected = _prepare_records_strax(raw_records, allow_sloppy_chunking=True)
+    assert r.tobytes() == expected.tobytes()
+
+    for prepare in (straxen.prepare_records, _prepare_records_strax):
+        try:
+            prepare(raw_records)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('Baselined records without 0th fragment')
+
+
+def _muon_rich_records(n_muons=20, duration=int(1e8), n_channels=494):
+    """Background records with large muon-like clusters on top"""
+    rng = np.random.default_rng(2)
+    background = straxen.prepare_records(straxen.fake_daq_records(
+        0, duration, np.arange(n_channels), rate=2000, rng=3))
+
+    muons = []
+    for t in np.sort(rng.integers(0, duration - int(1e6), size=n_muons)):
+        # Some clusters have too few channels to trigger the veto
+        channels = np.arange(n_channels if rng.random() < 0.8 else 50)
+        n_records = rng.integers(1, 20, size=len(channels))
+        r = np.zeros(n_records.sum(), dtype=background.dtype)
+        r['channel'] = np.repeat(channels, n_records)
+        r['record_i'] = np.concatenate([np.arange(n) for n in n_records])
+        r['dt'] = 10
+        r['length'] = 110
+        r['pulse_length'] = 110 * np.repeat(n_records, n_records)
+        r['time'] = (t + rng.integers(0, 1000, size=len(r)) // 10 * 10
+                     + r['record_i'] * 1100)
+        r['area'] = rng.integers(-100, 50_000, size=len(r))
+        muons.append(r)
+    return strax.sort_by_time(np.concatenate([background] + muons))
+
+
+def test_he_veto_candidates():
+    records = _muon_rich_records()
+    to_pe = np.full(494, 0.01)
+    chunk_end = int(1e8)
+    for area_threshold in (1e4, 1e5, 1e6):
+        veto_start, veto_end = straxen.he_veto_candidates(
+            records, to_pe, chunk_end,
+            veto_length=int(3e6),
+            area_threshold=area_threshold)
+
+        # Same peaks as with strax.find_peaks
+        peaks = strax.find_peaks(
+            records, to_pe,
+            gap_threshold=1,
+            left_extension=0,
+            right_extension=0,
+            min_channels=100,
+            min_area=area_threshold,
+            result_dtype=strax.peak_dtype(n_channels=len(to_pe)))
+        assert len(peaks)
+        np.testing.assert_array_equal(veto_start, peaks['time'])
+
+        assert np.all(veto_end > veto_start)
+        assert np.all(veto_end <= chunk_end)
+        assert np.all(veto_end[:-1] <= veto_start[1:])
+
+    veto_start, veto_end = straxen.he_veto_candidates(records[:0], to_pe, chunk_end)
+    assert len(veto_start) == len(veto_end) == 0
+
+
+@strax.takes_config(
+    strax.Option('fake_rate', default=1000, type=int,
+                 help='Pulse rate per channel (Hz)'))
+class FakeRawRecords(strax.Plugin):
+    """A single chunk of synthetic raw_records"""
+    depends_on = tuple()
+    provides = 'raw_records'
+    dtype = strax.raw_record_dtype(110)
+    rechunk_on_save = False
+
+    def source_finished(self):
+        return True
+
+    def is_ready(self, chunk_i):
+        return chunk_i < 1
+
+    def compute(self, chunk_i):
+        duration = int(1e7)
+        raw_records = straxen.fake_daq_records(
+            0, duration, np.arange(494), rate=self.config['fake_rate'], rng=0)
+        return self.chunk(start=0, end=duration, data=raw_records)
+
+
+def test_peaklets_from_hits():
+    for config in (dict(), dict(pmt_pulse_filter=(0.1, 0.8, 0.1))):
+        st = strax.Context(
+            storage=[],
+            register=[FakeRawRecords, straxen.PulseProcessing, straxen.Peaklets],
+            config=dict(gain_model=('to_pe_constant', 0.005),
+                        n_tpc_pmts=494,
+                        **config))
+        hits = st.get_array('0', 'hits')
+        records = st.get_array('0', 'records')
+        assert len(hits)
+        # The stored hits are the hits in the stored records
+        expected = strax.find_hits(
+            records,
+            min_amplitude=straxen.hit_min_amplitude('pmt_commissioning_initial'))
+        for name in hits.dtype.names:
+            if name != 'max_sample':
+                np.testing.assert_array_equal(hits[name], expected[name])
+
+        peaklets = st.get_array('0', 'peaklets')
+        lone_hits = st.get_array('0', 'lone_hits')
+        assert len(peaklets)
+        st.register(straxen.PeakletsFromHits)
+        # Records and hits come from the same plugin
+        st.set_context_config(dict(allow_lazy=False))
+        np.testing.assert_array_equal(peaklets, st.get_array('0', 'peaklets'))
+        np.testing.assert_array_equal(lone_hits, st.get_array('0', 'lone_hits'))
+
+
+def test_check_overlaps():
+    records = straxen.fake_daq_records(0, int(1e7), np.arange(2000, 2120),
+                                       rate=1000, rng=0)
+    for n_shards in (1, 2, 5, 13):
+        for n_channels in (None, 3000):
+            straxen.check_overlaps(records, n_channels=n_channels,
+                                   n_shards=n_shards)
+
+    # Let a pulse start during the previous one in the same channel
+    first = np.where(records['record_i'] == 0)[0]
+    for r_i in (first[len(first) // 3], first[-1]):
+        ch = records[r_i]['channel']
+        before = np.where((records['channel'] == ch)
+                          & (np.arange(len(records)) < r_i))[0][-1]
+        bad = records.copy()
+        bad[r_i]['time'] = strax.endtime(records[before]) - 10
+        bad = strax.sort_by_time(bad)
+        # The serial check on all channels is the reference
+        messages = set()
+        for n_shards in (1, 2, 5, 13):
+            for n_channels in (None, 3000):
+                try:
+                    straxen.check_overlaps(bad, n_channels=n_channels,
+                                           n_shards=n_shards)
+                except ValueError as e:
+                    messages.add(str(e))
+                else:
+                    raise AssertionError('Overlap not found')
+        assert len(messages) == 1
+
+
+def test_pulse_processing_joint():
+    chunk_duration, overlap_duration = int(1e7), int(1e6)
+    channels = np.concatenate([np.arange(494), np.arange(500, 753)])
+    rate = np.where(channels < 494, 1000, 100)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        straxen.write_fake_daq_run(temp_dir,
+                                   n_chunks=2,
+                                   chunk_duration=chunk_duration,
+                                   overlap_duration=overlap_duration,
+                                   channels=channels,
+                                   n_readers=4,
+                                   rate=rate)
+        st = strax.Context(
+            storage=[],
+            register=[straxen.DAQReader,
+                      straxen.PulseProcessing,
+                      straxen.PulseProcessingHighEnergy],
+            config=dict(daq_input_dir=temp_dir,
+                        daq_chunk_duration=chunk_duration,
+                        daq_overlap_chunk_duration=overlap_duration,
+                        readout_threads={'reader': 4},
+                        channel_map=straxen.contexts.xnt_common_config['channel_map'],
+                        n_tpc_pmts=494))
+        targets = ('records', 'hits', 'pulse_counts',
+                   'records_he', 'pulse_counts_he')
+        expected = {t: st.get_array('0', t) for t in targets}
+        assert len(expected['records']) and len(expected['records_he'])
+
+        st.register(straxen.PulseProcessingJoint)
+        # raw_records and raw_records_he come from the same plugin
+        st.set_context_config(dict(allow_lazy=False))
+        for t in targets:
+            # Compare bit for bit, np.testing would not consider nans equal
+            assert st.get_array('0', t).tobytes() == expected[t].tobytes(), t